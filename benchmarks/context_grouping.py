@@ -0,0 +1,50 @@
+"""
+Group 100k user contexts with a low number of distinct values.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/context_grouping.py
+"""
+import random
+import time
+import uuid
+from collections import OrderedDict
+
+from models.notifications import UserContext
+from services.context import group_contexts
+
+USERS = 100_000
+CONTEXT_VARS = ("first_name", "subscription_name")
+FIRST_NAMES = [f"name{i}" for i in range(50)]
+SUBSCRIPTIONS = ["basic", "premium", "family"]
+
+
+def build_contexts() -> list[UserContext]:
+    return [
+        UserContext.construct(
+            user_id=uuid.uuid4(),
+            context=OrderedDict(
+                first_name=random.choice(FIRST_NAMES),
+                subscription_name=random.choice(SUBSCRIPTIONS),
+                unused=random.random(),
+            ),
+        )
+        for _ in range(USERS)
+    ]
+
+
+def main():
+    contexts = build_contexts()
+
+    started = time.perf_counter()
+    groups = group_contexts(contexts, CONTEXT_VARS)
+    elapsed = time.perf_counter() - started
+
+    print(f"users:    {USERS}")
+    print(f"groups:   {len(groups)}")
+    print(f"users in groups: {sum(len(group.user_ids) for group in groups)}")
+    print(f"grouping: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
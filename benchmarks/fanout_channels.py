@@ -0,0 +1,66 @@
+"""
+Index and build the messages of 20k users with an email and an sms channel
+each, for a campaign to the same audience again, so that every address is
+already validated.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/fanout_channels.py
+"""
+import time
+import uuid
+from collections import OrderedDict
+
+from models.notifications import GroupedContext, Notification
+from models.users import NotificationChannel, UserChannels
+from services.fanout import build_channel_index, build_messages
+
+USERS = 20_000
+GROUPS = 4
+
+
+def build_batch() -> tuple[Notification, list[GroupedContext], list[UserChannels]]:
+    users = [uuid.uuid4() for _ in range(USERS)]
+    users_channels = [
+        UserChannels(
+            id=str(user_id),
+            channels=[
+                NotificationChannel(type="email", value=f"user{n}@example.com"),
+                NotificationChannel(type="sms", value=f"+{n}"),
+            ],
+        )
+        for n, user_id in enumerate(users)
+    ]
+    groups = [
+        GroupedContext(user_ids=users[n::GROUPS], context=OrderedDict(bucket=n))
+        for n in range(GROUPS)
+    ]
+    notification = Notification(
+        id=uuid.uuid4(),
+        template_id=uuid.uuid4(),
+        channels=["email"],
+        context_vars={},
+        title="Hello",
+    )
+    return notification, groups, users_channels
+
+
+def main():
+    notification, groups, users_channels = build_batch()
+
+    started = time.perf_counter()
+    build_channel_index(users_channels)
+    cold = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = build_channel_index(users_channels)
+    messages = build_messages(notification, groups, index)
+    warm = time.perf_counter() - started
+
+    print(f"users: {USERS}, contexts: {GROUPS}, messages: {len(messages)}")
+    print(f"index, cold cache: {cold * 1000:8.1f} ms")
+    print(f"index and build:   {warm * 1000:8.1f} ms  {USERS / warm:,.0f} users/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Build the messages of one 60k recipient batch, validating every address
+into EmailStr models as before, and through the channel index that
+validates each distinct address once and builds the messages trusted.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/message_build.py
+"""
+import time
+import uuid
+from collections import OrderedDict
+
+from pydantic import BaseModel, EmailStr
+
+from core.config import publisher_properties, settings, user_properties
+from models.fields import configure_email_cache
+from models.notifications import GroupedContext, Notification
+from models.queue import Message
+from models.users import NotificationChannel, UserChannels
+from services.fanout import build_channel_index, build_messages, split_recipients
+
+USERS = 60_000
+GROUPS = 20
+
+
+class ValidatedEmailTitle(BaseModel):
+    to_: list[EmailStr]
+    from_: EmailStr
+    subject: str
+
+
+def build_batch() -> tuple[Notification, list[UserChannels], list[GroupedContext]]:
+    notification = Notification(
+        id=uuid.uuid4(),
+        template_id=uuid.uuid4(),
+        channels=["email"],
+        context_vars={"first_name": None},
+        title="Weekly digest",
+    )
+    users_channels = [
+        UserChannels.construct(
+            id=str(uuid.uuid4()),
+            channels=[
+                NotificationChannel.construct(type="email", value=f"user{i}@movix.ru")
+            ],
+        )
+        for i in range(USERS)
+    ]
+    grouped_context = [
+        GroupedContext.construct(
+            user_ids=[
+                uuid.UUID(user_channels.id)
+                for user_channels in users_channels[group::GROUPS]
+            ],
+            context=OrderedDict(first_name=f"name{group}"),
+        )
+        for group in range(GROUPS)
+    ]
+    return notification, users_channels, grouped_context
+
+
+def build_validated(notification, users_channels, grouped_context) -> list[Message]:
+    """Every address goes through email-validator on every build."""
+    addresses = {
+        user_channels.id: user_channels.channels[0].value
+        for user_channels in users_channels
+    }
+    messages = []
+    for group in grouped_context:
+        group_addresses = [addresses[str(user_id)] for user_id in group.user_ids]
+        for chunk in split_recipients(
+            group_addresses,
+            publisher_properties.message_max_recipients,
+            publisher_properties.message_max_recipients_bytes,
+        ):
+            recipients = ValidatedEmailTitle(
+                to_=chunk,
+                from_=user_properties.notifications_email_from,
+                subject=notification.title,
+            )
+            messages.append(
+                Message.construct(
+                    context=group.context,
+                    template_id=notification.template_id,
+                    type="email",
+                    recipients=recipients,
+                )
+            )
+    return messages
+
+
+def build_trusted(notification, users_channels, grouped_context) -> list[Message]:
+    channel_index = build_channel_index(users_channels)
+    return build_messages(notification, grouped_context, channel_index)
+
+
+def measure(name: str, build, *batch) -> list[Message]:
+    started = time.perf_counter()
+    messages = build(*batch)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {elapsed * 1000:8.1f} ms  {len(messages)} messages")
+    return messages
+
+
+def main():
+    batch = build_batch()
+    print(f"recipients: {USERS}, contexts: {GROUPS}")
+
+    validated = measure("validated", build_validated, *batch)
+    configure_email_cache(settings.email_cache_size)
+    measure("trusted, cold cache", build_trusted, *batch)
+    trusted = measure("trusted, warm cache", build_trusted, *batch)
+
+    assert sorted(a for m in validated for a in m.recipients.to_) == sorted(
+        a for m in trusted for a in m.recipients.to_
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the ways a queue message can be turned into a JSON body.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/message_serialization.py
+"""
+import timeit
+import uuid
+from collections import OrderedDict
+
+import orjson
+
+from core.codec import MessageCodec
+from models.queue import EmailTitle, Message, MessageType
+
+RECIPIENTS = (1_000, 10_000)
+
+
+def build_message(recipients: int) -> Message:
+    return Message(
+        context=OrderedDict(first_name="Alan", subscription_name="Movix Premium"),
+        template_id=uuid.uuid4(),
+        type=MessageType.email,
+        recipients=EmailTitle(
+            to_=[f"user{i}@movix.ru" for i in range(recipients)],
+            from_="notifications@movix.ru",
+            subject="Weekly digest",
+        ),
+    )
+
+
+def main():
+    codec = MessageCodec()
+    serializers = {
+        "message.json() + utf8": lambda m: bytes(m.json(), encoding="utf8"),
+        "orjson(message.dict())": lambda m: orjson.dumps(m.dict()),
+        "codec.encode(message)": codec.encode,
+    }
+
+    for recipients in RECIPIENTS:
+        message = build_message(recipients)
+        expected = orjson.loads(message.json())
+        print(f"recipients: {recipients}")
+
+        for name, serialize in serializers.items():
+            assert orjson.loads(serialize(message)) == expected
+            number = 200 if recipients < 10_000 else 20
+            elapsed = timeit.timeit(lambda: serialize(message), number=number)
+            print(f"  {name:<24} {elapsed / number * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure time-to-first-batch and peak RSS while streaming notification recipients.
+
+Needs a database with the notifications schema (see core.config for the
+connection settings). Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/notification_users_stream.py <notification_id>
+"""
+import asyncio
+import resource
+import sys
+import time
+from uuid import UUID
+
+from core.config import user_properties
+from db.notifications import SANotificationDB, async_session_maker
+
+
+async def main(notification_id: UUID):
+    started = time.perf_counter()
+    first_batch = None
+    batches = users = 0
+
+    async with async_session_maker() as session:
+        db = SANotificationDB(session)
+        async for users_ids in db.get_notification_users(
+            notification_id, user_properties.users_limit
+        ):
+            if first_batch is None:
+                first_batch = time.perf_counter() - started
+            batches += 1
+            users += len(users_ids)
+
+    total = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"users:            {users}")
+    print(f"batches:          {batches}")
+    print(f"time to 1st batch {(first_batch or 0) * 1000:.1f} ms")
+    print(f"total time:       {total:.2f} s")
+    print(f"peak RSS:         {peak_rss:.1f} MiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(UUID(sys.argv[1])))
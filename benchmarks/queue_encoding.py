@@ -0,0 +1,74 @@
+"""
+Compare queue message payload sizes and encode/decode times per codec.
+
+Run from the repository root:
+
+    PYTHONPATH=src python benchmarks/queue_encoding.py
+"""
+import timeit
+import uuid
+from collections import OrderedDict
+
+from core.codec import Compression, Encoding, MessageCodec, decode
+from models.queue import EmailTitle, Message, MessageType
+
+RECIPIENTS = (1_000, 10_000, 60_000)
+CODECS = [
+    (Encoding.json, Compression.identity),
+    (Encoding.json, Compression.gzip),
+    (Encoding.json, Compression.zstd),
+    (Encoding.msgpack, Compression.identity),
+    (Encoding.msgpack, Compression.gzip),
+    (Encoding.msgpack, Compression.zstd),
+]
+
+
+def build_message(recipients: int) -> Message:
+    return Message(
+        context=OrderedDict(first_name="Alan", subscription_name="Movix Premium"),
+        template_id=uuid.uuid4(),
+        type=MessageType.email,
+        recipients=EmailTitle(
+            to_=[f"user{i}@example.com" for i in range(recipients)],
+            from_="notifications@movix.ru",
+            subject="Enjoy your movies!",
+        ),
+    )
+
+
+def main():
+    print(
+        f"{'recipients':>10} {'codec':<18} {'bytes':>10} {'encode ms':>10} {'decode ms':>10}"
+    )
+    for recipients in RECIPIENTS:
+        message = build_message(recipients)
+        print(
+            f"{recipients:>10} {'pydantic .json()':<18} {len(message.json()):>10}",
+            end="",
+        )
+        seconds = min(timeit.repeat(message.json, number=5, repeat=3)) / 5
+        print(f" {seconds * 1000:>10.2f}")
+
+        for encoding, compression in CODECS:
+            codec = MessageCodec(encoding, compression)
+            body = codec.encode(message)
+
+            encode = min(
+                timeit.repeat(lambda: codec.encode(message), number=5, repeat=3)
+            )
+            decode_ = min(
+                timeit.repeat(
+                    lambda: decode(body, codec.content_type, codec.content_encoding),
+                    number=5,
+                    repeat=3,
+                )
+            )
+            name = f"{encoding.value}+{compression.value}"
+            print(
+                f"{recipients:>10} {name:<18} {len(body):>10}"
+                f" {encode / 5 * 1000:>10.2f} {decode_ / 5 * 1000:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
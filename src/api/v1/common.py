@@ -15,3 +15,5 @@ class ErrorCodeReasonModel(BaseModel):
 
 class ErrorCode(str, Enum):
     NOTIFICATION_NOT_FOUND = "NOTIFICATION_NOT_FOUND"
+    JOB_NOT_FOUND = "JOB_NOT_FOUND"
+    EVENT_NOT_FOUND = "EVENT_NOT_FOUND"
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Depends
+
+from models.metrics import (
+    CacheStats,
+    HTTPClientStats,
+    OutboxStats,
+    PublisherStats,
+    UserCacheStats,
+)
+from services.http import get_http_stats
+from services.notification_cache import NotificationCache, get_notification_cache
+from services.outbox import Outbox, get_outbox
+from services.publisher import RabbitMQPublisher, get_publisher
+from services.user_cache import get_channels_cache, get_users_cache
+
+router = APIRouter()
+
+
+@router.get("/publisher", response_model=PublisherStats)
+async def publisher_stats(
+    publisher: RabbitMQPublisher = Depends(get_publisher),
+) -> PublisherStats:
+    return publisher.stats()
+
+
+@router.get("/outbox", response_model=OutboxStats)
+async def outbox_stats(outbox: Outbox = Depends(get_outbox)) -> OutboxStats:
+    return await outbox.stats()
+
+
+@router.get("/notification-cache", response_model=CacheStats)
+async def notification_cache_stats(
+    notification_cache: NotificationCache = Depends(get_notification_cache),
+) -> CacheStats:
+    return notification_cache.stats()
+
+
+@router.get("/http", response_model=HTTPClientStats)
+async def http_client_stats() -> HTTPClientStats:
+    return get_http_stats()
+
+
+@router.get("/user-cache", response_model=UserCacheStats)
+async def user_cache_stats() -> UserCacheStats:
+    return UserCacheStats(
+        users=get_users_cache().stats(), channels=get_channels_cache().stats()
+    )
@@ -1,74 +1,108 @@
+import typing
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import BaseModel, ValidationError
 
 from api.v1.common import ErrorCode
-from core.config import user_properties
-from models.events import (
-    UserOnPaymentError,
-    UserOnRefund,
-    UserOnRegistration,
-    UserOnSubscription,
-)
-from models.queue import EmailTitle, Message
-from models.users import UserChannels
+from core.exceptions import EventNameError
+from models.events import EventLineResult
+from models.jobs import FanoutJob
+from models.queue import Message
+from services.checkpoint import FanoutCheckpoints, get_fanout_checkpoints
 from services.event import EventService, get_event_service
+from services.event_batch import EventBatch, iter_lines
+from services.fanout import Fanout
+from services.jobs import FanoutJobs, get_fanout_jobs
 from services.notification import NotificationService, get_notification_service
-from services.publisher import RabbitMQPublisher, get_publisher
+from services.outbox import Outbox, get_outbox
 from services.user import UserService, get_user_service
 
 router = APIRouter()
 
 
 @router.post("/message", response_model=None)
-async def post_message(
-    message: Message, publisher: RabbitMQPublisher = Depends(get_publisher)
-) -> None:
-    await publisher.publish_message(message.json())
-
-
-@router.post("/events/registration/on", response_model=None)
-async def on_registration(
-    context: UserOnRegistration,
-    event_service: EventService = Depends(get_event_service),
-    publisher: RabbitMQPublisher = Depends(get_publisher),
-) -> None:
-    message = event_service.on_registration(context)
-
-    await publisher.publish_message(message.json())
-
-
-@router.post("/events/refund/on", response_model=None)
-async def on_refund(
-    context: UserOnRefund,
-    event_service: EventService = Depends(get_event_service),
-    publisher: RabbitMQPublisher = Depends(get_publisher),
-) -> Response(status_code=status.HTTP_200_OK):
-    message = event_service.on_refund(context)
-
-    await publisher.publish_message(message.json())
-
-
-@router.post("/events/subscription/on", response_model=None)
-async def on_subscription(
-    context: UserOnSubscription,
+async def post_message(message: Message, outbox: Outbox = Depends(get_outbox)) -> None:
+    await outbox.publish_message(message)
+
+
+@router.post("/messages", response_model=list[bool])
+async def post_messages(
+    messages: list[Message], outbox: Outbox = Depends(get_outbox)
+) -> list[bool]:
+    return await outbox.publish_many(messages)
+
+
+@router.post(
+    "/events/batch",
+    response_model=list[EventLineResult],
+    openapi_extra={
+        "requestBody": {
+            "content": {"application/x-ndjson": {"schema": {"type": "string"}}},
+            "required": True,
+        }
+    },
+)
+async def on_events_batch(
+    request: Request,
     event_service: EventService = Depends(get_event_service),
-    publisher: RabbitMQPublisher = Depends(get_publisher),
-) -> Response(status_code=status.HTTP_200_OK):
-    message = event_service.on_subscription(context)
-
-    await publisher.publish_message(message.json())
-
-
-@router.post("/events/payment-error/on", response_model=None)
-async def on_payment_error(
-    context: UserOnPaymentError,
+    outbox: Outbox = Depends(get_outbox),
+) -> list[EventLineResult]:
+    """
+    Ingest events as NDJSON, one {"event": name, "context": {...}} object
+    per line, where name is an event of the events registry. Returns the
+    outcome of every non-empty line.
+    """
+    batch = EventBatch(event_service, outbox)
+    return await batch.ingest(iter_lines(request.stream()))
+
+
+def add_event_route(name: str, payload_model: type[BaseModel]):
+    """Route an event of the registry, with its payload model as the body."""
+
+    async def on_event(
+        context: payload_model,  # type: ignore
+        event_service: EventService = Depends(get_event_service),
+        outbox: Outbox = Depends(get_outbox),
+    ) -> None:
+        message = event_service.on_event(name, context)
+
+        await outbox.publish_message(message)
+
+    router.add_api_route(
+        f"/events/{name}/on",
+        on_event,
+        methods=["POST"],
+        response_model=None,
+        name=f"on_{name}",
+    )
+
+
+for name, event in get_event_service().events.items():
+    add_event_route(name, event.payload_model)
+
+
+# Only reached by the names that are not in the registry
+@router.post("/events/{name}/on", response_model=None, include_in_schema=False)
+async def on_event(
+    name: str,
+    context: dict[str, typing.Any],
     event_service: EventService = Depends(get_event_service),
-    publisher: RabbitMQPublisher = Depends(get_publisher),
-) -> Response(status_code=status.HTTP_200_OK):
-    message = event_service.on_payment_error(context)
+    outbox: Outbox = Depends(get_outbox),
+) -> None:
+    """Send the message of an event of the events registry."""
+    try:
+        message = event_service.on_event(name, context)
+    except EventNameError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=ErrorCode.EVENT_NOT_FOUND
+        )
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors()
+        )
 
-    await publisher.publish_message(message.json())
+    await outbox.publish_message(message)
 
 
 @router.post("/{id_notification}", response_model=None)
@@ -76,7 +110,8 @@ async def generate_notifiaction(
     id_notification: UUID,
     user_service: UserService = Depends(get_user_service),
     notification_service: NotificationService = Depends(get_notification_service),
-    publisher: RabbitMQPublisher = Depends(get_publisher),
+    outbox: Outbox = Depends(get_outbox),
+    checkpoints: FanoutCheckpoints = Depends(get_fanout_checkpoints),
 ):
     notification = await notification_service.get_notification(id_notification)
 
@@ -85,36 +120,40 @@ async def generate_notifiaction(
             status.HTTP_400_BAD_REQUEST, detail=ErrorCode.NOTIFICATION_NOT_FOUND
         )
 
-    async for users_ids in notification_service.get_notification_users(id_notification):
-        users_channels = await user_service.get_users_channels(users_ids)  # type: ignore
-
-        for channel_type in notification.channels:
-            users_channels: list[UserChannels] = [
-                user_channels
-                for user_channels in users_channels
-                for channel in user_channels.channels
-                if channel.type == channel_type
-            ]
-
-            recipients: list[str] = [
-                channel.value
-                for user_channels in users_channels
-                for channel in user_channels.channels
-            ]
-
-            _recipients = EmailTitle(
-                to_=recipients,  # type: ignore
-                from_=user_properties.notifications_email_from,  # type: ignore
-                subject=notification.title,
-            )
-            context = await notification_service.generate_context(
-                notification, (user_channels.id for user_channels in users_channels)  # type: ignore
-            )
-            message = Message(
-                context=context,  # type: ignore
-                template_id=notification.template_id,
-                type=channel_type,  # type: ignore
-                recipients=_recipients,
-            )
-
-            await publisher.publish_message(message.json())
+    # A fan-out that was interrupted resumes after its last published batch
+    fanout = Fanout(user_service, notification_service, outbox, checkpoints)
+    await fanout.run(notification)
+    await checkpoints.clear(notification.id)
+
+
+@router.post(
+    "/{id_notification}/jobs",
+    response_model=FanoutJob,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def submit_notification_job(
+    id_notification: UUID,
+    notification_service: NotificationService = Depends(get_notification_service),
+    jobs: FanoutJobs = Depends(get_fanout_jobs),
+) -> FanoutJob:
+    """Queue the fan-out of a notification and return at once."""
+    notification = await notification_service.get_notification(id_notification)
+
+    if notification is None:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST, detail=ErrorCode.NOTIFICATION_NOT_FOUND
+        )
+
+    return await jobs.submit(id_notification)
+
+
+@router.get("/jobs/{job_id}", response_model=FanoutJob)
+async def get_notification_job(
+    job_id: UUID, jobs: FanoutJobs = Depends(get_fanout_jobs)
+) -> FanoutJob:
+    job = await jobs.get(job_id)
+
+    if job is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail=ErrorCode.JOB_NOT_FOUND)
+
+    return job
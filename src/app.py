@@ -1,19 +1,55 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
 
-from api.v1 import notification
+from api.v1 import metrics, notification
 from core.config import settings
 from core.logger import logger
+from db.redis import get_redis
+from services.event import get_event_service
+from services.http import get_http_client
+from services.jobs import get_shard_queue, get_shard_worker
+from services.notification_cache import get_notification_cache
+from services.outbox import get_outbox
+from services.publisher import get_publisher
 
 logger()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The events registry is prepared once, and a broken one fails the start
+    get_event_service()
+    publisher = get_publisher()
+    outbox = get_outbox()
+    notification_cache = get_notification_cache()
+    shard_queue = get_shard_queue()
+    shard_worker = get_shard_worker()
+    await publisher.connect()
+    await outbox.start()
+    await notification_cache.listen()
+    await shard_queue.connect()
+    await shard_worker.start()
+    yield
+    await shard_worker.stop()
+    await shard_queue.close()
+    await notification_cache.close()
+    await outbox.stop()
+    await publisher.close()
+    await get_redis().close()
+    await get_http_client().aclose()
+
+
 app = FastAPI(
     title=settings.project_name,
     docs_url="/api/openapi",
     openapi_url="/api/openapi.json",
     default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 app.include_router(
     notification.router, prefix="/api/v1/notification", tags=["notification"]
 )
+app.include_router(metrics.router, prefix="/api/v1/metrics", tags=["metrics"])
@@ -0,0 +1,123 @@
+import gzip
+import typing
+from datetime import datetime
+from enum import Enum
+from uuid import UUID
+
+import msgpack
+import orjson
+import zstandard
+from pydantic import BaseModel
+
+from models.notifications import GroupedContext
+from models.queue import EmailTitle, Message
+
+
+class Encoding(str, Enum):
+    json = "json"
+    msgpack = "msgpack"
+
+
+class Compression(str, Enum):
+    identity = "identity"
+    gzip = "gzip"
+    zstd = "zstd"
+
+
+CONTENT_TYPES = {
+    Encoding.json: "application/json",
+    Encoding.msgpack: "application/msgpack",
+}
+ENCODINGS = {content_type: encoding for encoding, content_type in CONTENT_TYPES.items()}
+
+
+# Models that have no aliases or custom encoders: their __dict__ holds
+# exactly what .dict() would return, minus the recursive copy
+DIRECT_MODELS = (Message, EmailTitle, GroupedContext)
+
+
+def _default(obj: typing.Any) -> typing.Any:
+    if isinstance(obj, DIRECT_MODELS):
+        return obj.__dict__
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, UUID):
+        return str(obj)
+    # As orjson writes them, for msgpack that has no datetime of its own
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+class MessageCodec:
+    """
+    Turns queue payloads into message bodies and back.
+
+    The encoding and compression are announced to consumers through the
+    AMQP content_type and content_encoding properties.
+    """
+
+    def __init__(
+        self,
+        encoding: Encoding = Encoding.json,
+        compression: Compression = Compression.identity,
+        level: int | None = None,
+    ):
+        self.encoding = Encoding(encoding)
+        self.compression = Compression(compression)
+        self.level = level
+
+        self.content_type = CONTENT_TYPES[self.encoding]
+        self.content_encoding = (
+            None if self.compression == Compression.identity else self.compression.value
+        )
+
+        if self.compression == Compression.zstd:
+            self._zstd = zstandard.ZstdCompressor(level=level or 3)
+
+    @property
+    def is_plain_json(self) -> bool:
+        return (
+            self.encoding == Encoding.json and self.compression == Compression.identity
+        )
+
+    def encode(self, payload: typing.Any) -> bytes:
+        """Encode plain data or pydantic models, nested ones included."""
+        if self.encoding == Encoding.msgpack:
+            body = msgpack.packb(payload, default=_default)
+        else:
+            body = orjson.dumps(payload, default=_default)
+        return self.compress(body)
+
+    def compress(self, body: bytes) -> bytes:
+        match self.compression:
+            case Compression.gzip:
+                return gzip.compress(body, compresslevel=self.level or 6)
+            case Compression.zstd:
+                return self._zstd.compress(body)
+        return body
+
+
+def decode(
+    body: bytes, content_type: str | None = None, content_encoding: str | None = None
+) -> typing.Any:
+    """
+    Decode a message body produced by MessageCodec.
+
+    Args:
+        body (bytes): The message body.
+        content_type (str): The AMQP content_type property of the message.
+        content_encoding (str): The AMQP content_encoding property of the message.
+
+    Returns:
+        The decoded payload.
+    """
+    match content_encoding:
+        case Compression.gzip:
+            body = gzip.decompress(body)
+        case Compression.zstd:
+            body = zstandard.ZstdDecompressor().decompress(body)
+
+    if ENCODINGS.get(content_type or "") == Encoding.msgpack:
+        return msgpack.unpackb(body)
+    return orjson.loads(body)
@@ -2,9 +2,12 @@ import os
 from logging import config as logging_config
 from uuid import UUID
 
-from pydantic import BaseSettings
+from pydantic import BaseSettings, Field
 
+from core.codec import Compression, Encoding
 from core.logger import LOG_LEVEL, get_logging_config
+from models.events import EventTemplate, PayloadType
+from models.fields import configure_email_cache
 
 
 class Settings(BaseSettings):
@@ -21,10 +24,44 @@ class Settings(BaseSettings):
     database_adapter: str = "postgresql"
     database_sqlalchemy_adapter: str = "postgresql+asyncpg"
 
+    # Настройки Redis
+    redis_url: str = "redis://localhost:6379/0"
+
     log_level: str = LOG_LEVEL
 
     pack_size: int = 1000
 
+    notification_cache_size: int = 1024
+    notification_cache_ttl: float = 300
+    notification_cache_redis: bool = False
+    notification_invalidation_channel: str = "notification_changed"
+    # Delay between attempts to listen again once the connection is lost
+    notification_listener_retry: float = 5
+
+    context_chain_timeout: float = 30
+    context_memo_size: int = 200000
+    # Validated email addresses kept across campaigns. Batches scan users in
+    # id order, so an audience larger than this evicts every address before
+    # it comes back: size it above the largest audience
+    email_cache_size: int = 500000
+
+    # Shards a fan-out job is split into and the RabbitMQ queue they go through
+    fanout_shards: int = 8
+    fanout_queue: str = "movix-notification-fanout"
+    # Shards run at once by every process; 0 leaves them to worker.py
+    fanout_workers: int = 2
+    fanout_job_ttl: float = 86400
+    fanout_checkpoint_ttl: float = 7 * 86400
+    # x-consumer-timeout of the shard queue: a shard not acked by then is
+    # delivered again, so it must exceed the longest shard run
+    fanout_shard_timeout: float = 6 * 3600
+    # Batches waiting between two fan-out stages
+    fanout_queue_size: int = 2
+    fanout_channels_concurrency: int = 2
+    fanout_context_concurrency: int = 2
+    fanout_build_concurrency: int = 1
+    fanout_publish_concurrency: int = 1
+
 
 class PublisherProperties(BaseSettings):
     amqp_url: str = (
@@ -36,13 +73,63 @@ class PublisherProperties(BaseSettings):
     publish_interval: int = 1
     queue: str = "movix-notification"
     routing_key: str = "notification.email"
+    channel_pool_size: int = 10
+    publish_timeout: float = 5.0
+    confirm_window: int = 1000
+    message_encoding: Encoding = Encoding.json
+    message_compression: Compression = Compression.identity
+    message_compression_level: int | None = None
+    # Upper bounds of the recipients of a single fan-out message
+    message_max_recipients: int = 500
+    message_max_recipients_bytes: int = 32 * 1024
+
+
+class OutboxProperties(BaseSettings):
+    outbox_file: str = "outbox.sqlite3"
+    outbox_flush_batch_size: int = 500
+    outbox_flush_interval: float = 0.5
+    outbox_lease: float = 30.0
+    outbox_retry_delay: float = 5.0
+    # Publish attempts before a message is moved to the outbox_dead table
+    outbox_max_attempts: int = 20
+
+
+def default_events() -> dict[str, EventTemplate]:
+    return {
+        "registration": EventTemplate(
+            template_id=UUID(int=0),
+            send_from="welcome@movix.ru",
+            subject="Confirm you email",
+            context={"verification_token": "verification_token"},
+            payload={"id_user": PayloadType.uuid},
+            static_context={"verefy_url": UsersProperties().url_verify},
+        ),
+        "subscription": EventTemplate(
+            template_id=UUID(int=1),
+            send_from="subscription@movix.ru",
+            subject="Enjoy your movies!",
+            context={"username": "username", "sub_name": "subscription_name"},
+        ),
+        "refund": EventTemplate(
+            template_id=UUID(int=2),
+            send_from="refund@movix.ru",
+            subject="Your refund status",
+            context={"username": "username", "amount": "amount"},
+        ),
+        "payment-error": EventTemplate(
+            template_id=UUID(int=3),
+            send_from="subscription@movix.ru",
+            subject="One more step...",
+            context={"username": "username", "amount": "amount"},
+        ),
+    }
 
 
 class EventsProperties(BaseSettings):
-    on_registration_template_id: UUID = UUID(int=0)
-    on_registration_vars: list[str] = [""]
-    on_registration_send_from: str = "welcome@movix.ru"
-    on_registration_subject: str = "Confirm you email"
+    # Events of a batch request spooled to the outbox at once
+    events_batch_size: int = 1000
+    # Event name -> template; EVENTS replaces the table with a JSON object
+    events: dict[str, EventTemplate] = Field(default_factory=default_events)
 
 
 class UsersProperties(BaseSettings):
@@ -50,6 +137,11 @@ class UsersProperties(BaseSettings):
     url_get_users: str = "http://auth:8000/api/v1/users"
     url_verify: str = "http://auth:8000/api/v1/auth/verify"
     users_limit: int = 60000
+    users_chunk_size: int = 1000
+    users_concurrency: int = 8
+    users_cache_size: int = 100000
+    users_cache_ttl: float = 600
+    users_cache_redis: bool = True
     access_token: str = (
         "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzdWIiOiI2ZT"
         "RlZmEzNy0xMTkxLTQ3NzEtODExYy00MjgxOGIzYjJjYTkiLCJhdWQiOlsibW92aXg6"
@@ -60,14 +152,27 @@ class UsersProperties(BaseSettings):
     password: str = "123qwe"
     url_refresh_token: str = "http://auth:8000/api/v1/refresh"
     url_login: str = "http://auth:8000/api/v1/login"
+    token_refresh_margin: float = 30
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30
+    http_timeout: float = 10
+    http2: bool = False
     notifications_email_from: str = "notifications@movix.ru"
 
 
 settings = Settings()
 publisher_properties = PublisherProperties()
+outbox_properties = OutboxProperties()
 events_properties = EventsProperties()
 user_properties = UsersProperties()
-authorization_data = {"access_token": "", "refresh_token": ""}
+
+
+def get_database_url() -> str:
+    return (
+        f"{settings.database_adapter}://{settings.pguser}:"
+        f"{settings.pgpassword}@{settings.pghost}:{settings.pgport}/{settings.pgdb}"
+    )
 
 
 def get_database_url_async() -> str:
@@ -78,3 +183,4 @@ def get_database_url_async() -> str:
 
 
 logging_config.dictConfig(get_logging_config(level=settings.log_level))
+configure_email_cache(settings.email_cache_size)
@@ -0,0 +1,29 @@
+from bisect import bisect_left
+
+from models.metrics import HistogramSnapshot
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram. counts[i] holds the observations that fall in
+    (buckets[i - 1], buckets[i]]; the last count holds everything above."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> HistogramSnapshot:
+        return HistogramSnapshot(
+            buckets=list(self.buckets),
+            counts=list(self.counts),
+            count=self.count,
+            sum=self.sum,
+        )
@@ -0,0 +1,98 @@
+import asyncio
+import contextlib
+import time
+import typing
+
+from models.metrics import StageStats
+
+Handler = typing.Callable[[typing.Any], typing.Awaitable[typing.Any]]
+
+
+class Stage:
+    def __init__(self, name: str, handler: Handler, concurrency: int = 1):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(concurrency, 1)
+
+        self.queue: asyncio.Queue | None = None
+        self.in_flight = 0
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+    def stats(self) -> StageStats:
+        return StageStats(
+            name=self.name,
+            concurrency=self.concurrency,
+            queued=self.queue.qsize() if self.queue is not None else 0,
+            in_flight=self.in_flight,
+            processed=self.processed,
+            busy_seconds=self.busy_seconds,
+        )
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues.
+
+    Every stage runs `concurrency` workers that take an item from the stage
+    queue and put the handler result on the queue of the next stage, so the
+    stages overlap and a full queue holds back the stages before it. The
+    first error cancels the whole pipeline and is raised from `run`.
+
+    The source is closed once the pipeline stops, so that a generator over
+    a database cursor releases it before its session goes away.
+    """
+
+    def __init__(self, stages: typing.Sequence[Stage], maxsize: int = 1):
+        self.stages = stages
+        self.maxsize = maxsize
+
+    async def run(self, source: typing.AsyncGenerator[typing.Any, None]):
+        async with contextlib.aclosing(source):
+            await self._run(source)
+
+    async def _run(self, source: typing.AsyncGenerator[typing.Any, None]):
+        for stage in self.stages:
+            stage.queue = asyncio.Queue(self.maxsize)
+
+        async def drain():
+            async for item in source:
+                await self.stages[0].queue.put(item)  # type: ignore
+            for stage in self.stages:
+                await stage.queue.join()  # type: ignore
+
+        tasks = [asyncio.create_task(drain())]
+        for stage, following in zip(self.stages, [*self.stages[1:], None]):
+            inbox = following.queue if following is not None else None
+            tasks.extend(
+                asyncio.create_task(self._work(stage, inbox))
+                for _ in range(stage.concurrency)
+            )
+
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _work(self, stage: Stage, inbox: asyncio.Queue | None):
+        queue: asyncio.Queue = stage.queue  # type: ignore
+        while True:
+            item = await queue.get()
+            stage.in_flight += 1
+            started = time.perf_counter()
+            try:
+                result = await stage.handler(item)
+                stage.processed += 1
+                stage.busy_seconds += time.perf_counter() - started
+                if inbox is not None:
+                    await inbox.put(result)
+            finally:
+                stage.in_flight -= 1
+                queue.task_done()
+
+    def stats(self) -> list[StageStats]:
+        return [stage.stats() for stage in self.stages]
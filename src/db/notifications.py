@@ -7,9 +7,9 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa
 
-from core.config import get_database_url_async
+from core.config import get_database_url_async, settings
 from db.models_protocol import ID, NP
-from models.notifications import Notification
+from models.notifications import Notification, NotificationUsersCount
 
 
 class BaseNotificationDatabase(t.Generic[ID, NP]):
@@ -25,13 +25,19 @@ class BaseNotificationDatabase(t.Generic[ID, NP]):
         """Get a notification users"""
         raise NotImplementedError
 
+    async def count_notification_users(
+        self, notification_id: ID
+    ) -> NotificationUsersCount:
+        """Count a notification users and their group memberships"""
+        raise NotImplementedError
+
 
 class SANotificationDB(BaseNotificationDatabase[UUID, Notification]):
     session: AsyncSession
 
     def __init__(self, session: AsyncSession):
         self.session = session
-        self.pack_size = 1000
+        self.pack_size = settings.pack_size
 
     async def get_notification(self, notification_id: UUID) -> Notification | None:
         """Get a notification data"""
@@ -96,11 +102,33 @@ class SANotificationDB(BaseNotificationDatabase[UUID, Notification]):
         return notification
 
     async def get_notification_users(
-        self, notification_id: UUID, users_limit: int
+        self,
+        notification_id: UUID,
+        users_limit: int,
+        lower: UUID | None = None,
+        upper: UUID | None = None,
+        after: UUID | None = None,
     ) -> AsyncGenerator[list[UUID], None]:
-        """Get a notification users"""
+        """
+        Get the distinct users of a notification in user id order, optionally
+        only the [lower, upper) key range and only the ids that follow `after`.
+        A user in several of the recipient groups is yielded once.
+        """
+        query_params = {"notification_id": notification_id}
+        key_range = []
+        if lower is not None:
+            key_range.append("user_group_membership.user_id >= :lower")
+            query_params["lower"] = lower
+        if upper is not None:
+            key_range.append("user_group_membership.user_id < :upper")
+            query_params["upper"] = upper
+        if after is not None:
+            key_range.append("user_group_membership.user_id > :after")
+            query_params["after"] = after
+        where = f"WHERE {' AND '.join(key_range)}" if key_range else ""
+
         query_text = text(
-            """
+            f"""
         WITH notification_data AS (
             SELECT
                 recipients_id
@@ -109,33 +137,65 @@ class SANotificationDB(BaseNotificationDatabase[UUID, Notification]):
             WHERE
                 id = :notification_id
         )
-        SELECT
+        SELECT DISTINCT
             user_group_membership.user_id
         FROM
             notification_data
         INNER JOIN
             notifications.user_group_membership
         ON
-            notification_data.recipients_id = user_group_membership.group_id;
+            notification_data.recipients_id = user_group_membership.group_id
+        {where}
+        ORDER BY
+            user_group_membership.user_id;
         """
         )
-        query_params = {"notification_id": notification_id}
 
-        result = await self.session.execute(query_text, query_params)
-        result_not_empty = True
+        # A server-side cursor: rows arrive pack_size at a time instead of the
+        # whole membership being buffered on the client first.
+        result = await self.session.stream(
+            query_text, query_params, execution_options={"yield_per": self.pack_size}
+        )
+        users_ids: list[UUID] = []
+
+        try:
+            async for rows in result.partitions(self.pack_size):
+                users_ids.extend(row[0] for row in rows)
 
-        while result_not_empty:
-            users_ids = []
+                if len(users_ids) >= users_limit:
+                    yield users_ids
+                    users_ids = []
+        finally:
+            await result.close()
 
-            while result_not_empty and len(users_ids) < users_limit:
+        if users_ids:
+            yield users_ids
 
-                rows = result.fetchmany(self.pack_size)
-                if len(rows) == 0:
-                    result_not_empty = False
+    async def count_notification_users(
+        self, notification_id: UUID
+    ) -> NotificationUsersCount:
+        """Count a notification users and their group memberships"""
+        query_text = text(
+            """
+        SELECT
+            count(DISTINCT user_group_membership.user_id) AS users,
+            count(*) AS memberships
+        FROM
+            notifications.notification
+        INNER JOIN
+            notifications.user_group_membership
+        ON
+            notification.recipients_id = user_group_membership.group_id
+        WHERE
+            notification.id = :notification_id;
+        """
+        )
+        query_params = {"notification_id": notification_id}
 
-                users_ids.extend(row[0] for row in rows)
+        result = await self.session.execute(query_text, query_params)
+        row = result.one()
 
-            yield users_ids
+        return NotificationUsersCount(users=row.users, memberships=row.memberships)
 
 
 engine = create_async_engine(get_database_url_async())
@@ -0,0 +1,10 @@
+from functools import lru_cache
+
+from redis.asyncio import Redis
+
+from core.config import settings
+
+
+@lru_cache
+def get_redis() -> Redis:
+    return Redis.from_url(settings.redis_url)
@@ -1,58 +1,47 @@
+import typing
+from datetime import datetime
 from enum import Enum
 from uuid import UUID
 
-from .mixins import UserRecipientMixin
+from pydantic import BaseModel
 
+from .fields import CachedEmailStr
 
-class Events(str, Enum):
-    on_registration = "on_registration"
-    on_subscription = "on_subscription"
-    on_refund = "on_refund"
 
+class PayloadType(str, Enum):
+    string = "string"
+    integer = "integer"
+    number = "number"
+    boolean = "boolean"
+    uuid = "uuid"
+    datetime = "datetime"
 
-class RegistrationEvent:
-    template_id: UUID = UUID(int=0)
-    _vars: list[str] = [""]
-    send_from: str = "welcome@movix.ru"
-    subject: str = "Confirm you email"
 
+PAYLOAD_TYPES: dict[PayloadType, type] = {
+    PayloadType.string: str,
+    PayloadType.integer: int,
+    PayloadType.number: float,
+    PayloadType.boolean: bool,
+    PayloadType.uuid: UUID,
+    PayloadType.datetime: datetime,
+}
 
-class SubscriptionEvent:
-    template_id: UUID = UUID(int=1)
-    _vars: list[str] = [""]
-    send_from: str = "subscription@movix.ru"
-    subject: str = "Enjoy your movies!"
 
+class EventTemplate(BaseModel):
+    """How the message of an event is built from the event payload."""
 
-class RefundEvent:
-    template_id: UUID = UUID(int=2)
-    _vars: list[str] = [""]
-    send_from: str = "refund@movix.ru"
-    subject: str = "Your refund status"
+    template_id: UUID
+    send_from: CachedEmailStr
+    subject: str
+    # Context variable -> payload field it is taken from
+    context: dict[str, str] = {}
+    # Payload field -> type; the fields of the context default to strings
+    payload: dict[str, PayloadType] = {}
+    # Context variables that are the same for every event
+    static_context: dict[str, typing.Any] = {}
 
 
-class PaymentErrorEvent:
-    template_id: UUID = UUID(int=3)
-    _vars: list[str] = [""]
-    send_from: str = "subscription@movix.ru"
-    subject: str = "One more step..."
-
-
-class UserOnRegistration(UserRecipientMixin):
-    verification_token: str
-    id_user: UUID
-
-
-class UserOnSubscription(UserRecipientMixin):
-    username: str
-    subscription_name: str
-
-
-class UserOnRefund(UserRecipientMixin):
-    username: str
-    amount: str
-
-
-class UserOnPaymentError(UserRecipientMixin):
-    username: str
-    amount: str
+class EventLineResult(BaseModel):
+    line: int
+    ok: bool
+    error: str | None = None
@@ -0,0 +1,39 @@
+from functools import lru_cache
+
+from pydantic import EmailStr
+from pydantic.networks import validate_email
+
+
+def _normalize_email(value: str) -> str:
+    return validate_email(value)[1]
+
+
+# Sized by core.config from the email_cache_size setting
+_normalize_email_cached = lru_cache(maxsize=100_000)(_normalize_email)
+
+
+def configure_email_cache(size: int):
+    """Replace the cache of normalize_email with an empty one of this size."""
+    global _normalize_email_cached
+    _normalize_email_cached = lru_cache(maxsize=size)(_normalize_email)
+
+
+def normalize_email(value: str) -> str:
+    """
+    Validates an address with email-validator, once per cached address.
+
+    Returns:
+        str: The normalized address.
+
+    Raises:
+        EmailError: If the address is not valid.
+    """
+    return _normalize_email_cached(value)
+
+
+class CachedEmailStr(EmailStr):
+    """EmailStr that runs email-validator once per distinct address."""
+
+    @classmethod
+    def validate(cls, value: str) -> str:
+        return normalize_email(value)
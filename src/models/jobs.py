@@ -0,0 +1,69 @@
+from datetime import datetime, timezone
+from enum import Enum
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel, Field, validator
+
+from models.metrics import StageStats
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class FanoutJob(BaseModel):
+    id: UUID = Field(default_factory=uuid4)
+    notification_id: UUID
+    status: JobStatus = JobStatus.pending
+    # Distinct recipients, and the group memberships they were resolved from
+    total: int | None = None
+    memberships: int | None = None
+    # Share of the memberships dropped as duplicates
+    dedup_ratio: float = 0.0
+    processed: int = 0
+    messages: int = 0
+    shards: int = 1
+    shards_done: int = 0
+    shards_failed: int = 0
+    errors: list[str] = []
+    # Pipeline stages of the shards, by shard number
+    stages: dict[int, list[StageStats]] = {}
+    created_at: datetime = Field(default_factory=utcnow)
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    # Recipients per second
+    throughput: float = 0.0
+
+    @validator("dedup_ratio", always=True)
+    def compute_dedup_ratio(cls, v, values):
+        total, memberships = values.get("total"), values.get("memberships")
+        if not total or not memberships:
+            return 0.0
+
+        return 1 - total / memberships
+
+    @validator("throughput", always=True)
+    def compute_throughput(cls, v, values):
+        started_at = values.get("started_at")
+        if started_at is None:
+            return 0.0
+
+        elapsed = ((values.get("finished_at") or utcnow()) - started_at).total_seconds()
+        return values["processed"] / elapsed if elapsed > 0 else 0.0
+
+
+class FanoutShard(BaseModel):
+    """A [lower, upper) range of user ids of a fan-out job."""
+
+    job_id: UUID
+    notification_id: UUID
+    shard: int
+    lower: UUID | None = None
+    upper: UUID | None = None
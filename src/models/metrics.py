@@ -0,0 +1,61 @@
+from pydantic import BaseModel, validator
+
+
+class PublisherStats(BaseModel):
+    published: int
+    acked: int
+    nacked: int
+    in_flight: int
+    confirm_window: int
+
+
+class OutboxStats(BaseModel):
+    pending: int
+    spooled: int
+    flushed: int
+    failed: int
+    dead: int
+
+
+class CacheStats(BaseModel):
+    size: int
+    hits: int
+    redis_hits: int
+    misses: int
+    hit_ratio: float = 0.0
+
+    @validator("hit_ratio", always=True)
+    def compute_hit_ratio(cls, v, values):
+        found = values["hits"] + values["redis_hits"]
+        lookups = found + values["misses"]
+        return found / lookups if lookups else 0.0
+
+
+class UserCacheStats(BaseModel):
+    users: CacheStats
+    channels: CacheStats
+
+
+class HistogramSnapshot(BaseModel):
+    buckets: list[float]
+    counts: list[int]
+    count: int
+    sum: float
+
+
+class HTTPClientStats(BaseModel):
+    requests: int
+    connections_opened: int
+    connection_reuse: float
+    pool_connections: int
+    pool_idle: int
+    latency: HistogramSnapshot
+
+
+class StageStats(BaseModel):
+    name: str
+    concurrency: int
+    queued: int
+    in_flight: int
+    processed: int
+    busy_seconds: float
@@ -1,6 +1,8 @@
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel
+
+from models.fields import CachedEmailStr
 
 
 class UUIDMixin(BaseModel):
@@ -8,4 +10,4 @@ class UUIDMixin(BaseModel):
 
 
 class UserRecipientMixin(BaseModel):
-    email: EmailStr
+    email: CachedEmailStr
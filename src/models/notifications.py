@@ -18,6 +18,12 @@ class Notification(UUIDMixin):
     title: str
 
 
+class NotificationUsersCount(BaseModel):
+    users: int
+    # Group membership rows, a user in several groups counts once per group
+    memberships: int
+
+
 class UserContext(BaseModel):
     user_id: UUID
     context: OrderedDict[str, Any]
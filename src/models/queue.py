@@ -1,7 +1,9 @@
 from enum import Enum
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, root_validator
+from pydantic import BaseModel, root_validator
+
+from models.fields import CachedEmailStr
 
 
 class MessageType(str, Enum):
@@ -9,8 +11,8 @@ class MessageType(str, Enum):
 
 
 class EmailTitle(BaseModel):
-    to_: list[EmailStr]
-    from_: EmailStr
+    to_: list[CachedEmailStr]
+    from_: CachedEmailStr
     subject: str
 
 
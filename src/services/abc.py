@@ -1,11 +1,16 @@
 from abc import ABC
-from typing import AsyncGenerator, Callable, Iterable
+from typing import AsyncGenerator, Callable, Hashable, Iterable
 from uuid import UUID
 
 import httpx
 
 from db.notifications import BaseNotificationDatabase
-from models.notifications import GroupedContext, Notification, UserContext
+from models.notifications import (
+    GroupedContext,
+    Notification,
+    NotificationUsersCount,
+    UserContext,
+)
 from models.users import UserChannels
 
 
@@ -23,7 +28,7 @@ class ContextBase(ABC):
         self.notification = notification
         self.user_ids = user_ids
 
-    def hash_context(self, context: UserContext) -> str:
+    def hash_context(self, context: UserContext) -> Hashable:
         ...
 
     async def resolve_context(self) -> Iterable[GroupedContext]:
@@ -33,7 +38,7 @@ class ContextBase(ABC):
 
 class NotificationServiceABC(ABC):
     notification_db: BaseNotificationDatabase
-    get_context_handler: Callable[[Notification, Iterable[UUID]], ContextBase]
+    get_context_handler: Callable[..., ContextBase]
 
     async def get_notification(self, notification_id: UUID) -> Notification | None:
         ...
@@ -42,3 +47,8 @@ class NotificationServiceABC(ABC):
         self, notification_id: UUID
     ) -> AsyncGenerator[list[UUID], None]:
         ...
+
+    async def count_notification_users(
+        self, notification_id: UUID
+    ) -> NotificationUsersCount:
+        ...
@@ -0,0 +1,117 @@
+import asyncio
+import base64
+import math
+import time
+import uuid
+from functools import lru_cache
+
+import httpx
+import orjson
+
+from core.config import UsersProperties, user_properties
+from core.logger import logger
+
+LOGGER = logger()
+
+
+def get_token_expiration(token: str) -> float:
+    """
+    Read the exp claim of a JWT without verifying it.
+
+    Returns:
+        float: The expiration timestamp, or infinity if the token has none,
+        in which case it is used until the auth service rejects it.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(orjson.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return math.inf
+
+
+class TokenManager:
+    """
+    Keeps the access and refresh tokens of the notification service.
+
+    Tokens are reused until they are about to expire. Concurrent callers that
+    find the access token stale wait for a single refresh instead of each
+    logging in on their own.
+    """
+
+    def __init__(self, properties: UsersProperties = user_properties):
+        self.properties = properties
+        self.margin = properties.token_refresh_margin
+
+        self._access_token: str | None = None
+        self._access_expires_at = 0.0
+        self._refresh_token: str | None = None
+        self._refresh_expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self, token: str | None, expires_at: float) -> bool:
+        return token is not None and expires_at - self.margin > time.time()
+
+    async def get_access_token(self, client: httpx.AsyncClient) -> str:
+        if self._is_fresh(self._access_token, self._access_expires_at):
+            return self._access_token  # type: ignore
+
+        async with self._lock:
+            # Somebody else may have refreshed while we were waiting
+            if not self._is_fresh(self._access_token, self._access_expires_at):
+                await self._refresh(client)
+            return self._access_token  # type: ignore
+
+    def invalidate(self, access_token: str):
+        """Forget an access token rejected by the auth service."""
+        if self._access_token == access_token:
+            self._access_token = None
+
+    async def _refresh(self, client: httpx.AsyncClient):
+        if not self._is_fresh(self._refresh_token, self._refresh_expires_at):
+            await self._login(client)
+
+        response = await self._post_refresh(client)
+        if response.status_code == httpx.codes.UNAUTHORIZED:
+            await self._login(client)
+            response = await self._post_refresh(client)
+        response.raise_for_status()
+
+        tokens = response.json()
+        self._set_access_token(tokens["access_token"])
+        if tokens.get("refresh_token"):
+            self._set_refresh_token(tokens["refresh_token"])
+
+    async def _post_refresh(self, client: httpx.AsyncClient) -> httpx.Response:
+        headers = {
+            'X-Request-Id': str(uuid.uuid4()),
+            'Authorization': f'Bearer {self._refresh_token}',
+        }
+        response = await client.post(self.properties.url_refresh_token, headers=headers)
+        LOGGER.info("Access token refresh: %s", response.status_code)
+        return response
+
+    async def _login(self, client: httpx.AsyncClient):
+        headers = {'X-Request-Id': str(uuid.uuid4())}
+        data = {
+            "username": self.properties.username,
+            "password": self.properties.password,
+        }
+        response = await client.post(
+            self.properties.url_login, headers=headers, data=data
+        )
+        response.raise_for_status()
+        self._set_refresh_token(response.json()['refresh_token'])
+
+    def _set_access_token(self, access_token: str):
+        self._access_token = access_token
+        self._access_expires_at = get_token_expiration(access_token)
+
+    def _set_refresh_token(self, refresh_token: str):
+        self._refresh_token = refresh_token
+        self._refresh_expires_at = get_token_expiration(refresh_token)
+
+
+@lru_cache
+def get_token_manager() -> TokenManager:
+    return TokenManager()
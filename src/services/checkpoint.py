@@ -0,0 +1,82 @@
+import typing
+from functools import lru_cache
+from uuid import UUID
+
+from redis.asyncio import Redis
+
+from core.config import settings
+from db.redis import get_redis
+
+
+class FanoutCheckpoints:
+    """
+    Keyset checkpoints of the fan-outs in progress.
+
+    For every notification a Redis hash maps a [lower, upper) range of user
+    ids to the last user id whose messages were published, so a fan-out that
+    is run again picks up right after it. The checkpoints of a run are only
+    cleared once it completes, leaving those of the other runs of the same
+    notification in place. Synchronous fan-outs and job shards keep theirs
+    under separate namespaces, even for the same range.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        namespace: str = "sync",
+        ttl: float = settings.fanout_checkpoint_ttl,
+    ):
+        self.redis = redis
+        self.namespace = namespace
+        self.ttl = int(ttl)
+
+    @staticmethod
+    def _key(notification_id: UUID) -> str:
+        return f"fanout_checkpoint:{notification_id}"
+
+    def _field(self, lower: UUID | None, upper: UUID | None) -> str:
+        return f"{self.namespace}:{lower or ''}:{upper or ''}"
+
+    async def get(
+        self,
+        notification_id: UUID,
+        lower: UUID | None = None,
+        upper: UUID | None = None,
+    ) -> UUID | None:
+        raw = await self.redis.hget(
+            self._key(notification_id), self._field(lower, upper)
+        )
+        return UUID(raw.decode()) if raw is not None else None
+
+    async def save(
+        self,
+        notification_id: UUID,
+        last_user_id: UUID,
+        lower: UUID | None = None,
+        upper: UUID | None = None,
+    ):
+        key = self._key(notification_id)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, self._field(lower, upper), str(last_user_id))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def clear(
+        self,
+        notification_id: UUID,
+        ranges: typing.Iterable[tuple[UUID | None, UUID | None]] = ((None, None),),
+    ):
+        """Drop the checkpoints of the given [lower, upper) ranges."""
+        fields = [self._field(lower, upper) for lower, upper in ranges]
+        await self.redis.hdel(self._key(notification_id), *fields)
+
+
+@lru_cache
+def get_fanout_checkpoints() -> FanoutCheckpoints:
+    return FanoutCheckpoints(get_redis())
+
+
+@lru_cache
+def get_job_checkpoints() -> FanoutCheckpoints:
+    return FanoutCheckpoints(get_redis(), "job")
@@ -1,13 +1,24 @@
 import abc
+import asyncio
 import enum
+import time
 import typing
 import uuid
+from collections import OrderedDict
+from graphlib import TopologicalSorter
 
+import orjson
+
+from core.cache import TTLCache
+from core.config import settings
+from core.logger import logger
 from models.notifications import GroupedContext, Notification, UserContext
 from models.users import User
 from services import user as user_service
 from services.abc import ContextBase
 
+LOGGER = logger()
+
 
 async def get_users(user_ids: typing.Iterable[uuid.UUID]) -> typing.Iterable[User]:
     service = user_service.get_service()
@@ -15,12 +26,16 @@ async def get_users(user_ids: typing.Iterable[uuid.UUID]) -> typing.Iterable[Use
 
 
 class ContextHandlerBase(abc.ABC):
+    # Context variables the handler fills in and the ones it needs filled first
+    produces: typing.ClassVar[frozenset[str]] = frozenset()
+    consumes: typing.ClassVar[frozenset[str]] = frozenset()
+
     def __init__(self, mode: str, users_context: dict[uuid.UUID, UserContext]):
         self.mode = mode
         self.users_context = users_context
 
     @abc.abstractmethod
-    async def handle(user_ids: typing.Iterable[uuid.UUID]):
+    async def handle(self, user_ids: typing.Iterable[uuid.UUID]):
         # Do smth
         ...
 
@@ -29,6 +44,8 @@ class ContextHandlerBase(abc.ABC):
 
 
 class ContextHandlerUser(ContextHandlerBase):
+    produces = frozenset(("first_name", "last_name", "username"))
+
     async def handle(self, user_ids: typing.Iterable[uuid.UUID]):
         users = await get_users(user_ids)
         if not users:
@@ -44,33 +61,109 @@ class ContextHandlerUser(ContextHandlerBase):
                 match key:
                     case "first_name":
                         user_context.context[key] = user.first_name
+                    case "last_name":
+                        user_context.context[key] = user.last_name
+                    case "username":
+                        user_context.context[key] = user.username
+
+
+HandlerType = type[ContextHandlerBase]
 
 
 class ContextHandlerChainBase(abc.ABC):
-    def __init__(self, mode: str, handlers: typing.Iterable[type[ContextHandlerBase]]):
+    def __init__(
+        self,
+        mode: str,
+        handlers: typing.Iterable[HandlerType],
+        timeout: float = settings.context_chain_timeout,
+    ):
         self.mode = mode
         self.handlers = handlers
+        self.timeout = timeout
         self.users_context = dict()
+        self.timings: dict[str, float] = {}
 
     async def before_chain_execution(self):
         # Do smth before chain execution
         ...
 
     async def after_chain_execution(self):
-        # Do smth after chain execution
-        ...
+        LOGGER.debug("Context handlers timings: %s", self.timings)
+
+    def build_graph(
+        self, context_vars: typing.Iterable[str]
+    ) -> dict[HandlerType, set[HandlerType]]:
+        """
+        Select the handlers producing the requested variables, plus the ones
+        producing what those consume, and map every handler to the handlers
+        it has to wait for.
+        """
+        producers: dict[str, list[HandlerType]] = {}
+        for handler in self.handlers:
+            for var in handler.produces:
+                producers.setdefault(var, []).append(handler)
+
+        graph: dict[HandlerType, set[HandlerType]] = {}
+        wanted = [h for var in context_vars for h in producers.get(var, ())]
+
+        while wanted:
+            handler = wanted.pop()
+            if handler in graph:
+                continue
+            dependencies = {
+                h
+                for var in handler.consumes
+                for h in producers.get(var, ())
+                if h is not handler
+            }
+            graph[handler] = dependencies
+            wanted.extend(dependencies)
+
+        return graph
 
     async def handle(
         self, context_vars: typing.Iterable[str], user_ids: typing.Iterable[uuid.UUID]
     ):
+        context_vars = list(context_vars)
+        user_ids = [uuid.UUID(str(user_id)) for user_id in user_ids]
+        self.users_context = {
+            user_id: UserContext.construct(
+                user_id=user_id, context=OrderedDict.fromkeys(context_vars)
+            )
+            for user_id in user_ids
+        }
+
         await self.before_chain_execution()
 
-        for handler in self.handlers:
-            handler_obj: ContextHandlerBase = handler(self.mode, self.users_context)
-            await handler_obj.handle(user_ids)  # type: ignore
+        sorter = TopologicalSorter(self.build_graph(context_vars))
+        sorter.prepare()
+        running: dict[asyncio.Task, HandlerType] = {}
+
+        try:
+            async with asyncio.timeout(self.timeout):
+                while sorter.is_active():
+                    for handler in sorter.get_ready():
+                        task = asyncio.create_task(self._run(handler, user_ids))
+                        running[task] = handler
+
+                    done, _ = await asyncio.wait(
+                        running, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        task.result()
+                        sorter.done(running.pop(task))
+        finally:
+            for task in running:
+                task.cancel()
 
         await self.after_chain_execution()
 
+    async def _run(self, handler: HandlerType, user_ids: list[uuid.UUID]):
+        started = time.perf_counter()
+        handler_obj: ContextHandlerBase = handler(self.mode, self.users_context)
+        await handler_obj.handle(user_ids)
+        self.timings[handler.__name__] = time.perf_counter() - started
+
     async def get_context(self) -> typing.Iterable[UserContext]:
         return self.users_context.values()
 
@@ -79,56 +172,142 @@ class ContextHandlerChain(ContextHandlerChainBase):
     ...
 
 
+class ContextMemo:
+    """
+    Resolved user contexts of one fan-out job, keyed by
+    (notification id, user id), so that a user is resolved once per job.
+    """
+
+    def __init__(self, maxsize: int = settings.context_memo_size):
+        self.contexts: TTLCache[tuple[uuid.UUID, uuid.UUID], UserContext] = TTLCache(
+            maxsize
+        )
+
+    def get_many(
+        self, notification_id: uuid.UUID, user_ids: typing.Iterable[uuid.UUID]
+    ) -> tuple[list[UserContext], list[uuid.UUID]]:
+        found, missing = [], []
+        for user_id in user_ids:
+            context = self.contexts.get((notification_id, user_id))
+            if context is None:
+                missing.append(user_id)
+            else:
+                found.append(context)
+        return found, missing
+
+    def set_many(
+        self, notification_id: uuid.UUID, contexts: typing.Iterable[UserContext]
+    ):
+        for context in contexts:
+            self.contexts.set((notification_id, context.user_id), context)
+
+
 class Context(ContextBase):
     def __init__(
-        self, notification: Notification, user_ids: typing.Iterable[uuid.UUID]
+        self,
+        notification: Notification,
+        user_ids: typing.Iterable[uuid.UUID],
+        memo: ContextMemo | None = None,
     ):
         self.notification = notification
         self.user_ids = user_ids
+        self.memo = memo
 
-    def hash_context(self, context: UserContext) -> str:
-        return str([item for item in context.context.items()])
+    def hash_context(self, context: UserContext) -> typing.Hashable:
+        return context_key(context, self.notification.context_vars)
 
     async def resolve_context(self) -> typing.Iterable[GroupedContext]:
         """Go to each variable handler"""
         if self.notification is None:
             return
 
-        mode, handlers = get_chain_mode_by_notification(notification=self.notification)
-        chain = ContextHandlerChain(mode, handlers)
-        await chain.handle(self.notification.context_vars, self.user_ids)
+        user_ids = [uuid.UUID(str(user_id)) for user_id in self.user_ids]
+        user_contexts: list[UserContext] = []
 
-        # В этот момент контекст это структура [{user_id: [context_var1, context_var2, ...]}, {user_id2: ...}]
-        user_contexts: typing.Iterable[UserContext] = await chain.get_context()
-        group_contexts = dict()
+        if self.memo is not None:
+            user_contexts, user_ids = self.memo.get_many(self.notification.id, user_ids)
 
-        # Группируем одинаковый контекст
-        for context in user_contexts:
-            key = self.hash_context(context)
-            group_context = group_contexts.get(
-                key, GroupedContext(user_ids=[], context=context.context)
+        if user_ids:
+            mode, handlers = get_chain_mode_by_notification(
+                notification=self.notification
             )
-            group_context.user_ids.append(context.user_id)
+            chain = ContextHandlerChain(mode, handlers)
+            await chain.handle(self.notification.context_vars, user_ids)
+
+            # В этот момент контекст это структура [{user_id: [context_var1, context_var2, ...]}, {user_id2: ...}]
+            resolved: typing.Iterable[UserContext] = await chain.get_context()
+            if self.memo is not None:
+                self.memo.set_many(self.notification.id, resolved)
+            user_contexts.extend(resolved)
 
-        self.context = group_contexts.values()
+        self.context = group_contexts(user_contexts, self.notification.context_vars)
         return self.context
 
 
-class ContextChain(tuple[str, typing.Iterable[type[ContextHandlerBase]]], enum.Enum):
+def _hashable(value: typing.Any) -> typing.Hashable:
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+
+
+def context_key(
+    context: UserContext, context_vars: typing.Iterable[str]
+) -> typing.Hashable:
+    """Canonical key of a user context built from the declared variables only."""
+    values = context.context
+    key = tuple([values.get(var) for var in context_vars])
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        return tuple(_hashable(value) for value in key)
+
+
+def group_contexts(
+    user_contexts: typing.Iterable[UserContext], context_vars: typing.Iterable[str]
+) -> list[GroupedContext]:
+    """Group users sharing the same context in one pass.
+
+    Groups only keep references to the users ids, and the models are built
+    without re-validating them.
+    """
+    context_vars = tuple(context_vars)
+    groups: dict[typing.Hashable, GroupedContext] = {}
+
+    for context in user_contexts:
+        key = context_key(context, context_vars)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = GroupedContext.construct(
+                user_ids=[],
+                context=OrderedDict(
+                    (var, context.context.get(var)) for var in context_vars
+                ),
+            )
+        group.user_ids.append(context.user_id)
+
+    return list(groups.values())
+
+
+class ContextChain(tuple[str, typing.Iterable[HandlerType]], enum.Enum):
     # Возможно, в дальнейшем будет потребность вводить разные цепи обработки
     default = "default", (ContextHandlerUser,)
 
 
 def get_chain_mode_by_notification(
     notification: Notification,
-) -> tuple[str, typing.Iterable[type[ContextHandlerBase]]]:
+) -> tuple[str, typing.Iterable[HandlerType]]:
     return ContextChain.default
 
 
 def get_context_handler(
-    notification: Notification, user_ids: typing.Iterable[uuid.UUID]
+    notification: Notification,
+    user_ids: typing.Iterable[uuid.UUID],
+    memo: ContextMemo | None = None,
 ) -> Context:
-    return Context(notification, user_ids)
+    return Context(notification, user_ids, memo)
 
 
 async def get_context_handler_dependency():
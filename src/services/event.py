@@ -1,65 +1,93 @@
+import typing
 from functools import lru_cache
 
-import models.events as events
-from core.config import user_properties
+from pydantic import BaseModel, create_model
+
+from core.config import EventsProperties, events_properties
+from core.exceptions import EventNameError
+from models.events import PAYLOAD_TYPES, EventTemplate, PayloadType
+from models.mixins import UserRecipientMixin
 from models.queue import EmailTitle, Message, MessageType
 
 
-class EventService:
-    def _create_message(
-        self, context: dict, template_id: str, type: MessageType, recipients: list
-    ) -> Message:
-        return Message(
-            context=context, template_id=template_id, type=type, recipients=recipients
-        )
+class PreparedEvent:
+    """
+    An event template with everything that does not depend on the payload
+    built once: the payload model, the sender and the static context.
+    """
 
-    def on_registration(self, user: events.UserOnRegistration):
-        event_obj = events.RegistrationEvent()
-        context = {
-            "verefy_url": user_properties.url_verify,
-            "verification_token": user.verification_token,
+    def __init__(self, name: str, template: EventTemplate):
+        types = dict.fromkeys(template.context.values(), PayloadType.string)
+        types.update(template.payload)
+        fields = {
+            field: (PAYLOAD_TYPES[type_], ...)
+            for field, type_ in types.items()
+            if field not in UserRecipientMixin.__fields__
         }
-        email = EmailTitle(
-            to_=[user.email], from_=event_obj.send_from, subject=event_obj.subject
+        # Named as the per-event models were, e.g. UserOnPaymentError
+        model_name = "UserOn" + "".join(
+            part.capitalize() for part in name.replace("_", "-").split("-")
         )
-        message = self._create_message(
-            context, event_obj.template_id, MessageType.email, recipients=email
+        self.payload_model: type[BaseModel] = create_model(
+            model_name, __base__=UserRecipientMixin, **fields  # type: ignore
         )
-        return message
+        self.template_id = template.template_id
+        # Already normalized by the CachedEmailStr field of the template
+        self.send_from = template.send_from
+        self.subject = template.subject
+        self.context = list(template.context.items())
+        self.static_context = template.static_context
 
-    def on_refund(self, user: events.UserOnRefund):
-        event_obj = events.RefundEvent()
-        context = {"username": user.username, "amount": user.amount}
-        email = EmailTitle(
-            to_=[user.email], from_=event_obj.send_from, subject=event_obj.subject
-        )
-        message = self._create_message(
-            context, event_obj.template_id, MessageType.email, recipients=email
-        )
-        return message
-
-    def on_subscription(self, user: events.UserOnSubscription):
-        event_obj = events.SubscriptionEvent()
-        print(user, '!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-        context = {"username": user.username, "sub_name": user.subscription_name}
-        email = EmailTitle(
-            to_=[user.email], from_=event_obj.send_from, subject=event_obj.subject
-        )
-        message = self._create_message(
-            context, event_obj.template_id, MessageType.email, recipients=email
-        )
-        return message
+    def build(self, payload: typing.Mapping[str, typing.Any] | BaseModel) -> Message:
+        """Build the message of a payload, validated unless it is the model."""
+        if isinstance(payload, self.payload_model):
+            user = payload
+        else:
+            user = self.payload_model.parse_obj(payload)
+
+        context = dict(self.static_context)
+        for variable, field in self.context:
+            context[variable] = getattr(user, field)
 
-    def on_payment_error(self, user: events.UserOnPaymentError):
-        event_obj = events.PaymentErrorEvent()
-        context = {"username": user.username, "amount": user.amount}
-        email = EmailTitle(
-            to_=[user.email], from_=event_obj.send_from, subject=event_obj.subject
+        # Trusted: the address was validated by the payload model
+        recipients = EmailTitle.construct(
+            to_=[user.email], from_=self.send_from, subject=self.subject  # type: ignore
         )
-        message = self._create_message(
-            context, event_obj.template_id, MessageType.email, recipients=email
+        return Message.construct(
+            context=context,
+            template_id=self.template_id,
+            type=MessageType.email,
+            recipients=recipients,
         )
-        return message
+
+
+class EventService:
+    """
+    Builds the messages of the events of the EventsProperties registry, so
+    that a new event is a new entry of the registry rather than new code.
+    """
+
+    def __init__(self, properties: EventsProperties = events_properties):
+        self.events = {
+            name: PreparedEvent(name, template)
+            for name, template in properties.events.items()
+        }
+
+    def on_event(
+        self, name: str, context: typing.Mapping[str, typing.Any] | BaseModel
+    ) -> Message:
+        """
+        Builds the message of an event given by name.
+
+        Raises:
+            EventNameError: If there is no such event.
+            ValidationError: If the context does not fit the event.
+        """
+        event = self.events.get(name)
+        if event is None:
+            raise EventNameError(name)
+
+        return event.build(context)
 
 
 @lru_cache
@@ -0,0 +1,101 @@
+import typing
+
+import orjson
+
+from core.config import EventsProperties, events_properties
+from core.exceptions import EventNameError
+from core.logger import logger
+from models.events import EventLineResult
+from models.queue import Message
+from services.event import EventService
+from services.outbox import Outbox
+
+LOGGER = logger()
+
+
+async def iter_lines(
+    chunks: typing.AsyncIterable[bytes],
+) -> typing.AsyncIterator[bytes]:
+    """Split a streamed body into lines as the chunks arrive."""
+    tail = b""
+    async for chunk in chunks:
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            yield line
+
+    if tail:
+        yield tail
+
+
+class EventBatch:
+    """
+    Ingests NDJSON events, one {"event": name, "context": {...}} per line.
+
+    Lines are parsed and turned into messages as they arrive, and the
+    messages are spooled to the outbox events_batch_size at a time.
+    """
+
+    def __init__(
+        self,
+        event_service: EventService,
+        outbox: Outbox,
+        properties: EventsProperties = events_properties,
+    ):
+        self.event_service = event_service
+        self.outbox = outbox
+        self.batch_size = properties.events_batch_size
+
+    def _parse(self, line: bytes) -> Message:
+        event = orjson.loads(line)
+        if not isinstance(event, dict):
+            raise ValueError("An event must be a JSON object")
+
+        name, context = event.get("event"), event.get("context")
+        if not isinstance(name, str):
+            raise ValueError("The event name must be a string")
+        if not isinstance(context, dict):
+            raise ValueError("The event context must be a JSON object")
+
+        return self.event_service.on_event(name, context)
+
+    async def ingest(self, lines: typing.AsyncIterable[bytes]) -> list[EventLineResult]:
+        results: list[EventLineResult] = []
+        pending: list[tuple[EventLineResult, Message]] = []
+        number = 0
+
+        async for line in lines:
+            number += 1
+            if not line.strip():
+                continue
+
+            result = EventLineResult(line=number, ok=False)
+            results.append(result)
+            try:
+                pending.append((result, self._parse(line)))
+            except ValueError as e:
+                # Not JSON, or a context that does not fit the event
+                result.error = str(e)
+            except EventNameError as e:
+                result.error = f"Unknown event: {e}"
+
+            if len(pending) >= self.batch_size:
+                await self._publish(pending)
+                pending = []
+
+        await self._publish(pending)
+        return results
+
+    async def _publish(self, pending: list[tuple[EventLineResult, Message]]):
+        if not pending:
+            return
+
+        try:
+            spooled = await self.outbox.publish_many(message for _, message in pending)
+        except Exception as e:
+            LOGGER.error(f"Unable to spool {len(pending)} events. {e}")
+            for result, _ in pending:
+                result.error = "Unable to spool the event"
+            return
+
+        for (result, _), ok in zip(pending, spooled):
+            result.ok = ok
@@ -0,0 +1,315 @@
+import contextlib
+import re
+import typing
+from uuid import UUID
+
+from core.config import (
+    PublisherProperties,
+    Settings,
+    publisher_properties,
+    settings,
+    user_properties,
+)
+from core.logger import logger
+from core.pipeline import Pipeline, Stage
+from models.fields import normalize_email
+from models.metrics import StageStats
+from models.notifications import GroupedContext, Notification, NotificationChannelTypes
+from models.queue import EmailTitle, Message, MessageType
+from models.users import NotificationChannel, UserChannels
+from services.checkpoint import FanoutCheckpoints
+from services.context import ContextMemo
+from services.notification import NotificationService
+from services.outbox import Outbox
+from services.user import UserService
+
+LOGGER = logger()
+
+# Called with the recipients and the messages of every published batch
+OnBatch = typing.Callable[[int, int], typing.Awaitable[None]]
+
+CANONICAL_UUID = re.compile(
+    "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+).fullmatch
+
+# Channel type -> ordered (user id, address) pairs
+ChannelIndex = dict[str, list[tuple[str, str]]]
+
+
+def canonical_user_id(value: str) -> str:
+    """
+    The user id in the form str(UUID) gives, as in the context groups.
+
+    Raises:
+        ValueError: If the value is not a UUID.
+    """
+    # Most ids already are: skip parsing them into a UUID
+    if CANONICAL_UUID(value):
+        return value
+    return str(UUID(value))
+
+
+def channel_address(channel: NotificationChannel) -> str | None:
+    """The address of a channel, normalized for email, None if invalid."""
+    if channel.type != NotificationChannelTypes.email:
+        return channel.value
+
+    try:
+        return normalize_email(channel.value)
+    except ValueError:
+        return None
+
+
+def build_channel_index(users_channels: typing.Iterable[UserChannels]) -> ChannelIndex:
+    """
+    Partition the recipients by channel type in one pass over the auth
+    service response, keeping the first occurrence of every address.
+
+    Email addresses are validated and normalized here, once per distinct
+    address, so the messages can be built from them without validation.
+    User ids are put in the canonical form the context groups use.
+    """
+    index: ChannelIndex = {}
+    seen: dict[str, set[str]] = {}
+    invalid = 0
+
+    for user_channels in users_channels:
+        try:
+            user_id = canonical_user_id(user_channels.id)
+        except ValueError:
+            LOGGER.error(f"Skipped the invalid user id {user_channels.id!r}.")
+            continue
+
+        for channel in user_channels.channels:
+            address = channel_address(channel)
+            if address is None:
+                invalid += 1
+                continue
+
+            addresses = seen.setdefault(channel.type, set())
+            if address in addresses:
+                continue
+            addresses.add(address)
+            index.setdefault(channel.type, []).append((user_id, address))
+
+    if invalid:
+        LOGGER.error(f"Skipped {invalid} invalid email addresses.")
+
+    return index
+
+
+def split_recipients(
+    addresses: typing.Iterable[str], max_count: int, max_bytes: int
+) -> typing.Iterator[list[str]]:
+    """
+    Chunks of at most max_count addresses that take at most max_bytes once
+    encoded. An address bigger than the budget gets a chunk of its own.
+    """
+    chunk: list[str] = []
+    size = 0
+
+    for address in addresses:
+        # The quotes and the separator around it in the encoded list
+        cost = len(address.encode()) + 3
+        if chunk and (len(chunk) >= max_count or size + cost > max_bytes):
+            yield chunk
+            chunk, size = [], 0
+
+        chunk.append(address)
+        size += cost
+
+    if chunk:
+        yield chunk
+
+
+def build_messages(
+    notification: Notification,
+    grouped_context: typing.Iterable[GroupedContext],
+    channel_index: ChannelIndex,
+    properties: PublisherProperties = publisher_properties,
+) -> list[Message]:
+    """
+    One message per channel, distinct context and chunk of recipients, so
+    that no message grows past the recipients limits of the relay.
+    """
+    groups = list(grouped_context)
+    sender = normalize_email(user_properties.notifications_email_from)
+    group_of_user = {
+        str(user_id): position
+        for position, group in enumerate(groups)
+        for user_id in group.user_ids
+    }
+    messages: list[Message] = []
+
+    for channel_type in notification.channels:
+        message_type = MessageType(channel_type)
+        recipients: list[list[str]] = [[] for _ in groups]
+        for user_id, address in channel_index.get(channel_type, ()):
+            position = group_of_user.get(user_id)
+            if position is not None:
+                recipients[position].append(address)
+
+        for group, addresses in zip(groups, recipients):
+            for chunk in split_recipients(
+                addresses,
+                properties.message_max_recipients,
+                properties.message_max_recipients_bytes,
+            ):
+                # Trusted: the addresses were validated by build_channel_index
+                _recipients = EmailTitle.construct(
+                    to_=chunk, from_=sender, subject=notification.title
+                )
+                message = Message.construct(
+                    context=group.context,
+                    template_id=notification.template_id,
+                    type=message_type,
+                    recipients=_recipients,
+                )
+                messages.append(message)
+
+    return messages
+
+
+class FanoutBatch:
+    """A recipient batch on its way through the fan-out stages."""
+
+    def __init__(self, number: int, users_ids: list[UUID]):
+        self.number = number
+        self.users_ids = users_ids
+        self.users_channels: typing.Iterable[UserChannels] = ()
+        self.channel_index: ChannelIndex = {}
+        self.grouped_context: typing.Iterable[GroupedContext] = ()
+        self.messages: list[Message] = []
+
+
+async def numbered_batches(
+    users_batches: typing.AsyncGenerator[list[UUID], None]
+) -> typing.AsyncGenerator[FanoutBatch, None]:
+    number = 0
+    async with contextlib.aclosing(users_batches):
+        async for users_ids in users_batches:
+            yield FanoutBatch(number, users_ids)
+            number += 1
+
+
+class PublishedBatches:
+    """
+    Batches leave the pipeline out of order; a checkpoint may only move past
+    a batch once every batch before it has been published too.
+    """
+
+    def __init__(self):
+        self._pending: dict[int, UUID] = {}
+        self._next = 0
+
+    def complete(self, number: int, last_user_id: UUID) -> UUID | None:
+        """
+        Returns:
+            UUID: The last user id of the batches published in order so far,
+            None if the batch did not extend them.
+        """
+        self._pending[number] = last_user_id
+        checkpoint = None
+        while self._next in self._pending:
+            checkpoint = self._pending.pop(self._next)
+            self._next += 1
+
+        return checkpoint
+
+
+class Fanout:
+    """
+    Generates and publishes the messages of a notification as a pipeline:
+    recipients are read from the database while earlier batches wait on the
+    auth service, have their context resolved, are built and published.
+
+    With checkpoints, the last user id of the published batches is recorded
+    as they complete in order, and a run starts right after the recorded one.
+    """
+
+    def __init__(
+        self,
+        user_service: UserService,
+        notification_service: NotificationService,
+        outbox: Outbox,
+        checkpoints: FanoutCheckpoints | None = None,
+        properties: Settings = settings,
+    ):
+        self.user_service = user_service
+        self.notification_service = notification_service
+        self.outbox = outbox
+        self.checkpoints = checkpoints
+        self.properties = properties
+        self.pipeline: Pipeline | None = None
+
+    async def run(
+        self,
+        notification: Notification,
+        on_batch: OnBatch | None = None,
+        lower: UUID | None = None,
+        upper: UUID | None = None,
+    ):
+        """Fan out to every recipient, or only to the [lower, upper) user ids."""
+        memo = ContextMemo()
+        checkpoints = self.checkpoints
+        after = None
+        if checkpoints is not None:
+            after = await checkpoints.get(notification.id, lower, upper)
+
+        published = PublishedBatches()
+
+        async def lookup_channels(batch: FanoutBatch) -> FanoutBatch:
+            batch.users_channels = await self.user_service.get_users_channels(
+                batch.users_ids
+            )
+            batch.channel_index = build_channel_index(batch.users_channels)
+            return batch
+
+        async def resolve_context(batch: FanoutBatch) -> FanoutBatch:
+            # The context does not depend on the channel: resolve it once per batch
+            batch.grouped_context = await self.notification_service.generate_context(
+                notification, (user_channels.id for user_channels in batch.users_channels), memo  # type: ignore
+            )
+            return batch
+
+        async def build(batch: FanoutBatch) -> FanoutBatch:
+            batch.messages = build_messages(
+                notification, batch.grouped_context, batch.channel_index
+            )
+            return batch
+
+        async def publish(batch: FanoutBatch) -> FanoutBatch:
+            await self.outbox.publish_many(batch.messages)
+
+            last_user_id = published.complete(batch.number, batch.users_ids[-1])
+            if checkpoints is not None and last_user_id is not None:
+                await checkpoints.save(notification.id, last_user_id, lower, upper)
+
+            if on_batch is not None:
+                await on_batch(len(batch.users_ids), len(batch.messages))
+            return batch
+
+        properties = self.properties
+        self.pipeline = Pipeline(
+            [
+                Stage(
+                    "channels", lookup_channels, properties.fanout_channels_concurrency
+                ),
+                Stage(
+                    "context", resolve_context, properties.fanout_context_concurrency
+                ),
+                Stage("build", build, properties.fanout_build_concurrency),
+                Stage("publish", publish, properties.fanout_publish_concurrency),
+            ],
+            properties.fanout_queue_size,
+        )
+        await self.pipeline.run(
+            numbered_batches(
+                self.notification_service.get_notification_users(
+                    notification.id, lower, upper, after
+                )
+            )
+        )
+
+    def stats(self) -> list[StageStats]:
+        return self.pipeline.stats() if self.pipeline is not None else []
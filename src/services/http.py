@@ -0,0 +1,67 @@
+import time
+from functools import lru_cache
+
+import httpx
+
+from core.config import UsersProperties, user_properties
+from core.metrics import Histogram
+from models.metrics import HTTPClientStats
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Connection pool transport that records latency and connection reuse."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = Histogram()
+        self.requests = 0
+        self.connections_opened = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+        started = time.perf_counter()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def stats(self) -> HTTPClientStats:
+        connections = self._pool.connections
+        reuse = 1 - self.connections_opened / self.requests if self.requests else 0.0
+        return HTTPClientStats(
+            requests=self.requests,
+            connections_opened=self.connections_opened,
+            connection_reuse=reuse,
+            pool_connections=len(connections),
+            pool_idle=sum(connection.is_idle() for connection in connections),
+            latency=self.latency.snapshot(),
+        )
+
+
+def create_http_client(
+    properties: UsersProperties = user_properties,
+) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=properties.http_max_connections,
+        max_keepalive_connections=properties.http_max_keepalive_connections,
+        keepalive_expiry=properties.http_keepalive_expiry,
+    )
+    transport = InstrumentedTransport(limits=limits, http2=properties.http2)
+    return httpx.AsyncClient(transport=transport, timeout=properties.http_timeout)
+
+
+@lru_cache
+def get_http_client() -> httpx.AsyncClient:
+    """The client shared by everything that talks to the auth service."""
+    return create_http_client()
+
+
+def get_http_stats() -> HTTPClientStats:
+    transport: InstrumentedTransport = get_http_client()._transport  # type: ignore
+    return transport.stats()
@@ -0,0 +1,425 @@
+import asyncio
+import typing
+from functools import lru_cache
+from uuid import UUID
+
+import aio_pika
+import orjson
+from aio_pika.abc import (
+    AbstractChannel,
+    AbstractIncomingMessage,
+    AbstractQueue,
+    AbstractRobustConnection,
+)
+from pydantic import ValidationError
+from redis.asyncio import Redis
+
+from core.config import Settings, publisher_properties, settings
+from core.logger import logger
+from db.notifications import SANotificationDB, async_session_maker
+from db.redis import get_redis
+from models.jobs import FanoutJob, FanoutShard, JobStatus, utcnow
+from models.metrics import StageStats
+from models.notifications import NotificationUsersCount
+from services.checkpoint import FanoutCheckpoints, get_job_checkpoints
+from services.context import get_context_handler
+from services.fanout import Fanout
+from services.notification import NotificationService
+from services.notification_cache import get_notification_cache
+from services.outbox import get_outbox
+from services.user import get_service
+
+LOGGER = logger()
+
+# Only the latest errors of a job are kept
+MAX_JOB_ERRORS = 10
+
+KeyRange = tuple[UUID | None, UUID | None]
+
+# The job scripts leave a job hash that expired or was deleted alone rather
+# than recreate a partial one without a TTL
+START_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSETNX', KEYS[1], 'started_at', ARGV[1])
+redis.call('HSET', KEYS[1], 'status', ARGV[2])
+return 1
+"""
+
+PROGRESS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HINCRBY', KEYS[1], 'processed', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'messages', ARGV[2])
+redis.call('HSET', KEYS[1], ARGV[3], ARGV[4])
+return 1
+"""
+
+COUNT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('HSET', KEYS[1], 'total', ARGV[1], 'memberships', ARGV[2])
+return 1
+"""
+
+# Returns the final status once the last shard is done, the empty string
+# while shards remain and nothing when the job is gone
+FINISH_SHARD_SCRIPT = """
+local shards = redis.call('HGET', KEYS[1], 'shards')
+if not shards then return false end
+if ARGV[1] ~= '' then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('HINCRBY', KEYS[1], 'shards_failed', 1)
+end
+local done = redis.call('HINCRBY', KEYS[1], 'shards_done', 1)
+if done ~= tonumber(shards) then return '' end
+local failed = tonumber(redis.call('HGET', KEYS[1], 'shards_failed') or '0')
+local status = ARGV[5]
+if failed > 0 then status = ARGV[6] end
+redis.call('HSET', KEYS[1], 'status', status, 'finished_at', ARGV[4])
+return status
+"""
+
+
+def key_ranges(shards: int) -> list[KeyRange]:
+    """Split the user id space into `shards` equal [lower, upper) ranges."""
+    bounds = [UUID(int=(1 << 128) * number // shards) for number in range(1, shards)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+class JobStore:
+    """
+    Fan-out job state kept in Redis, so that any replica can report it.
+
+    A job is a hash with one JSON encoded field per attribute. Shard workers
+    in other processes update it concurrently, so progress is only ever
+    applied with HINCRBY and every shard writes its own stages field.
+    """
+
+    def __init__(self, redis: Redis, ttl: float = settings.fanout_job_ttl):
+        self.redis = redis
+        self.ttl = int(ttl)
+        self._start = redis.register_script(START_SCRIPT)
+        self._progress = redis.register_script(PROGRESS_SCRIPT)
+        self._count = redis.register_script(COUNT_SCRIPT)
+        self._finish_shard = redis.register_script(FINISH_SHARD_SCRIPT)
+
+    @staticmethod
+    def _key(job_id: UUID) -> str:
+        return f"fanout_job:{job_id}"
+
+    @staticmethod
+    def _errors_key(job_id: UUID) -> str:
+        return f"fanout_job:{job_id}:errors"
+
+    async def create(self, job: FanoutJob):
+        # Unset fields are left out so that start() can HSETNX started_at
+        fields = orjson.loads(
+            job.json(
+                exclude={"errors", "stages", "throughput", "dedup_ratio"},
+                exclude_none=True,
+            )
+        )
+        key = self._key(job.id)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={k: orjson.dumps(v) for k, v in fields.items()})
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def get(self, job_id: UUID) -> FanoutJob | None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key(job_id))
+            pipe.lrange(self._errors_key(job_id), 0, -1)
+            raw, errors = await pipe.execute()
+
+        if not raw:
+            return None
+
+        fields: dict[str, typing.Any] = {"stages": {}}
+        for name, value in raw.items():
+            name, _, shard = name.decode().partition(":")
+            if shard:
+                fields[name][int(shard)] = orjson.loads(value)
+            else:
+                fields[name] = orjson.loads(value)
+
+        fields["errors"] = [error.decode() for error in errors]
+        return FanoutJob.parse_obj(fields)
+
+    async def start(self, job_id: UUID) -> bool:
+        """
+        Returns:
+            bool: False if the job is gone, expired or deleted.
+        """
+        started = await self._start(
+            keys=[self._key(job_id)],
+            args=[orjson.dumps(utcnow()), orjson.dumps(JobStatus.running)],
+        )
+        return bool(started)
+
+    async def count(self, job_id: UUID, users_count: NotificationUsersCount):
+        await self._count(
+            keys=[self._key(job_id)], args=[users_count.users, users_count.memberships]
+        )
+
+    async def progress(
+        self,
+        job_id: UUID,
+        shard: int,
+        recipients: int,
+        messages: int,
+        stages: list[StageStats],
+    ):
+        stages_json = orjson.dumps([stage.dict() for stage in stages])
+        await self._progress(
+            keys=[self._key(job_id)],
+            args=[recipients, messages, f"stages:{shard}", stages_json],
+        )
+
+    async def finish_shard(
+        self, job_id: UUID, error: str | None = None
+    ) -> JobStatus | None:
+        """
+        Count a shard as done; the last one to finish closes the job.
+
+        Returns:
+            JobStatus: The final status of the job, None while shards remain
+            or once the job is gone.
+        """
+        status = await self._finish_shard(
+            keys=[self._key(job_id), self._errors_key(job_id)],
+            args=[
+                error or "",
+                MAX_JOB_ERRORS,
+                self.ttl,
+                orjson.dumps(utcnow()),
+                orjson.dumps(JobStatus.done),
+                orjson.dumps(JobStatus.failed),
+            ],
+        )
+        return JobStatus(orjson.loads(status)) if status else None
+
+
+class ShardQueue:
+    """Durable RabbitMQ work queue that the fan-out shards go through."""
+
+    def __init__(
+        self, properties: Settings = settings, url: str = publisher_properties.amqp_url
+    ):
+        self.name = properties.fanout_queue
+        # Overrides the 30 minutes broker default, shorter than a large shard
+        self.arguments = {
+            "x-consumer-timeout": int(properties.fanout_shard_timeout * 1000)
+        }
+        self._url = url
+
+        self._connection: AbstractRobustConnection | None = None
+        self._channel: AbstractChannel | None = None
+        self._consumer: tuple[AbstractQueue, str] | None = None
+
+    async def connect(self):
+        if self._connection is not None:
+            return
+
+        self._connection = await aio_pika.connect_robust(self._url)
+        self._channel = await self._connection.channel(publisher_confirms=True)
+        await self._channel.declare_queue(
+            self.name, durable=True, arguments=self.arguments
+        )
+
+    async def close(self):
+        await self.cancel()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            self._channel = None
+
+    async def publish_many(self, shards: typing.Iterable[FanoutShard]):
+        await self.connect()
+        exchange = self._channel.default_exchange  # type: ignore
+
+        for shard in shards:
+            message = aio_pika.Message(
+                shard.json().encode(),
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            )
+            await exchange.publish(message, routing_key=self.name)
+
+    async def consume(
+        self,
+        callback: typing.Callable[[AbstractIncomingMessage], typing.Awaitable[None]],
+        prefetch: int,
+    ):
+        """Deliver at most `prefetch` shards at a time to the callback."""
+        await self.connect()
+
+        channel = await self._connection.channel()  # type: ignore
+        await channel.set_qos(prefetch_count=prefetch)
+        queue = await channel.declare_queue(
+            self.name, durable=True, arguments=self.arguments
+        )
+        self._consumer = queue, await queue.consume(callback)
+
+    async def cancel(self):
+        if self._consumer is not None:
+            queue, consumer_tag = self._consumer
+            self._consumer = None
+            await queue.cancel(consumer_tag)
+            await queue.channel.close()
+
+
+class FanoutJobs:
+    """
+    Coordinator of the fan-out jobs.
+
+    A job is split into fanout_shards ranges of user ids that are queued for
+    the shard workers, in this process or in any number of worker processes.
+    Its recipients are counted in the background, as the count scans the
+    whole membership of the recipient groups.
+    """
+
+    def __init__(
+        self, store: JobStore, queue: ShardQueue, properties: Settings = settings
+    ):
+        self.store = store
+        self.queue = queue
+        self.shards = properties.fanout_shards
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, notification_id: UUID) -> FanoutJob:
+        job = FanoutJob(notification_id=notification_id, shards=self.shards)
+        await self.store.create(job)
+
+        await self.queue.publish_many(
+            FanoutShard(
+                job_id=job.id,
+                notification_id=notification_id,
+                shard=number,
+                lower=lower,
+                upper=upper,
+            )
+            for number, (lower, upper) in enumerate(key_ranges(self.shards))
+        )
+
+        task = asyncio.create_task(self._count(job.id, notification_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _count(self, job_id: UUID, notification_id: UUID):
+        try:
+            async with async_session_maker() as session:
+                users_count = await SANotificationDB(session).count_notification_users(
+                    notification_id
+                )
+            await self.store.count(job_id, users_count)
+        except Exception as e:
+            LOGGER.error(f"Unable to count the recipients of fan-out job {job_id}. {e}")
+
+    async def get(self, job_id: UUID) -> FanoutJob | None:
+        return await self.store.get(job_id)
+
+
+class ShardWorker:
+    """Runs the fan-out of the shards it takes from the shard queue."""
+
+    def __init__(
+        self,
+        store: JobStore,
+        queue: ShardQueue,
+        checkpoints: FanoutCheckpoints,
+        properties: Settings = settings,
+    ):
+        self.store = store
+        self.queue = queue
+        self.checkpoints = checkpoints
+        self.concurrency = properties.fanout_workers
+
+    async def start(self):
+        if self.concurrency > 0:
+            await self.queue.consume(self._on_message, self.concurrency)
+
+    async def stop(self):
+        await self.queue.cancel()
+
+    async def _on_message(self, message: AbstractIncomingMessage):
+        # Acked once the shard has run, so the shard of a worker that died
+        # halfway, or that could not record it in the job, is delivered again
+        try:
+            shard = FanoutShard.parse_raw(message.body)
+        except ValidationError as e:
+            LOGGER.error(f"Dropped a malformed fan-out shard. {e}")
+            await message.reject()
+            return
+
+        async with message.process(requeue=True, ignore_processed=True):
+            try:
+                await self.run_shard(shard)
+            except Exception as e:
+                LOGGER.error(
+                    f"Fan-out job {shard.job_id} shard {shard.shard} requeued. {e}"
+                )
+                raise
+
+    async def run_shard(self, shard: FanoutShard):
+        if not await self.store.start(shard.job_id):
+            # Acked: delivering it again would not bring the job back
+            LOGGER.error(
+                f"Dropped shard {shard.shard} of the expired fan-out job {shard.job_id}."
+            )
+            return
+
+        async def on_batch(recipients: int, messages: int):
+            await self.store.progress(
+                shard.job_id, shard.shard, recipients, messages, fanout.stats()
+            )
+
+        error = None
+        try:
+            async with async_session_maker() as session:
+                notification_service = NotificationService(
+                    SANotificationDB(session),
+                    get_context_handler,
+                    get_notification_cache(),
+                )
+                notification = await notification_service.get_notification(
+                    shard.notification_id
+                )
+                if notification is None:
+                    raise LookupError(f"Notification {shard.notification_id} not found")
+
+                # A shard delivered again resumes after its last published batch
+                fanout = Fanout(
+                    get_service(), notification_service, get_outbox(), self.checkpoints
+                )
+                await fanout.run(notification, on_batch, shard.lower, shard.upper)
+        except Exception as e:
+            LOGGER.error(f"Fan-out job {shard.job_id} shard {shard.shard} failed. {e}")
+            error = f"Shard {shard.shard}: {e}"
+
+        status = await self.store.finish_shard(shard.job_id, error)
+        if status == JobStatus.done:
+            job = await self.store.get(shard.job_id)
+            shards = job.shards if job is not None else 1
+            await self.checkpoints.clear(shard.notification_id, key_ranges(shards))
+
+
+@lru_cache
+def get_job_store() -> JobStore:
+    return JobStore(get_redis())
+
+
+@lru_cache
+def get_shard_queue() -> ShardQueue:
+    return ShardQueue()
+
+
+@lru_cache
+def get_fanout_jobs() -> FanoutJobs:
+    return FanoutJobs(get_job_store(), get_shard_queue())
+
+
+@lru_cache
+def get_shard_worker() -> ShardWorker:
+    return ShardWorker(get_job_store(), get_shard_queue(), get_job_checkpoints())
@@ -1,3 +1,4 @@
+import contextlib
 from typing import AsyncGenerator, Callable, Iterable
 from uuid import UUID
 
@@ -5,47 +6,77 @@ from fastapi import Depends
 
 from core.config import user_properties
 from db.notifications import SANotificationDB, get_notification_db
-from models.notifications import Notification
-from services.context import Context, get_context_handler_dependency
+from models.notifications import GroupedContext, Notification, NotificationUsersCount
+from services.context import Context, ContextMemo, get_context_handler_dependency
+from services.notification_cache import NotificationCache, get_notification_cache
 
 from .abc import NotificationServiceABC
 
 
 class NotificationService(NotificationServiceABC):
     notification_db: SANotificationDB
-    get_context_handler: Callable[[Notification, Iterable[UUID]], Context]
+    get_context_handler: Callable[..., Context]
 
     def __init__(
         self,
         notification_db: SANotificationDB,
-        get_context_handler: Callable[[Notification, Iterable[UUID]], Context],
+        get_context_handler: Callable[..., Context],
+        notification_cache: NotificationCache,
     ):
         self.notification_db = notification_db
         self.get_context_handler = get_context_handler
+        self.notification_cache = notification_cache
 
     async def get_notification(self, notification_id: UUID) -> Notification | None:
-        return await self.notification_db.get_notification(notification_id)
+        notification = await self.notification_cache.get(notification_id)
+        if notification is not None:
+            return notification
+
+        notification = await self.notification_db.get_notification(notification_id)
+        if notification is not None:
+            await self.notification_cache.set(notification)
+        return notification
 
     async def get_notification_users(
-        self, notification_id: UUID
+        self,
+        notification_id: UUID,
+        lower: UUID | None = None,
+        upper: UUID | None = None,
+        after: UUID | None = None,
     ) -> AsyncGenerator[list[UUID], None]:
-        async for users_ids in self.notification_db.get_notification_users(
-            notification_id=notification_id, users_limit=user_properties.users_limit
-        ):
-            yield users_ids
+        users_batches = self.notification_db.get_notification_users(
+            notification_id=notification_id,
+            users_limit=user_properties.users_limit,
+            lower=lower,
+            upper=upper,
+            after=after,
+        )
+        # Closing this generator closes the database cursor right away
+        async with contextlib.aclosing(users_batches):
+            async for users_ids in users_batches:
+                yield users_ids
+
+    async def count_notification_users(
+        self, notification_id: UUID
+    ) -> NotificationUsersCount:
+        return await self.notification_db.count_notification_users(notification_id)
 
     async def generate_context(
-        self, notification: Notification, user_ids: Iterable[UUID]
-    ) -> list:
-        handler = self.get_context_handler(notification, user_ids)
+        self,
+        notification: Notification,
+        user_ids: Iterable[UUID],
+        memo: ContextMemo | None = None,
+    ) -> Iterable[GroupedContext]:
+        handler = self.get_context_handler(notification, user_ids, memo)
         context = await handler.resolve_context()
         return context
 
 
 async def get_notification_service(
-    get_context_handler: Callable[[Notification, Iterable[UUID]], Context] = Depends(
+    get_context_handler: Callable[..., Context] = Depends(
         get_context_handler_dependency
     ),
     notification_db: SANotificationDB = Depends(get_notification_db),
+    notification_cache: NotificationCache = Depends(get_notification_cache),
 ) -> AsyncGenerator[NotificationService, None]:
-    yield NotificationService(notification_db, get_context_handler)
+    yield NotificationService(notification_db, get_context_handler, notification_cache)
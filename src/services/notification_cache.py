@@ -0,0 +1,186 @@
+import asyncio
+import math
+import time
+from functools import lru_cache
+from uuid import UUID
+
+import asyncpg
+from redis.asyncio import Redis
+
+from core.cache import TTLCache
+from core.config import Settings, get_database_url, settings
+from core.logger import logger
+from db.redis import get_redis
+from models.metrics import CacheStats
+from models.notifications import Notification
+
+LOGGER = logger()
+
+
+class NotificationCache:
+    """
+    Cache of notification metadata.
+
+    Entries live in an in-process LRU and, optionally, in Redis so that other
+    replicas can reuse them. They expire after notification_cache_ttl and are
+    dropped as soon as Postgres sends the id of a changed notification on
+    the notification_invalidation_channel. A lost listener connection is
+    opened again. Changes may have been missed meanwhile, so the local
+    entries are dropped, and Redis is not read again until the entries it
+    may hold from that time have expired. Redis errors fall back to Postgres.
+    """
+
+    def __init__(self, redis: Redis | None = None, properties: Settings = settings):
+        self.redis = redis
+        self.ttl = properties.notification_cache_ttl
+        self.channel = properties.notification_invalidation_channel
+        self.retry_delay = properties.notification_listener_retry
+        self.local: TTLCache[UUID, Notification] = TTLCache(
+            properties.notification_cache_size, self.ttl
+        )
+
+        self._listener: asyncpg.Connection | None = None
+        self._reconnect: asyncio.Task | None = None
+        # Redis is not read before this time.monotonic() value
+        self._redis_reads_after = 0.0
+        self._tasks: set[asyncio.Task] = set()
+        self.redis_hits = 0
+
+    @staticmethod
+    def _key(notification_id: UUID) -> str:
+        return f"notification:{notification_id}"
+
+    async def get(self, notification_id: UUID) -> Notification | None:
+        notification = self.local.get(notification_id)
+        if notification is not None or self.redis is None:
+            return notification
+        if time.monotonic() < self._redis_reads_after:
+            return None
+
+        try:
+            raw = await self.redis.get(self._key(notification_id))
+        except Exception as e:
+            LOGGER.error(
+                f"Unable to read notification {notification_id} from Redis. {e}"
+            )
+            return None
+        if raw is None:
+            return None
+
+        self.redis_hits += 1
+        notification = Notification.parse_raw(raw)
+        self.local.set(notification_id, notification)
+        return notification
+
+    async def set(self, notification: Notification):
+        self.local.set(notification.id, notification)
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.set(
+                self._key(notification.id), notification.json(), ex=int(self.ttl)
+            )
+        except Exception as e:
+            LOGGER.error(
+                f"Unable to write notification {notification.id} to Redis. {e}"
+            )
+
+    async def invalidate(self, notification_id: UUID):
+        self.local.pop(notification_id)
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.delete(self._key(notification_id))
+        except Exception as e:
+            LOGGER.error(
+                f"Unable to drop notification {notification_id} from Redis. {e}"
+            )
+            # The stale entry stays in Redis until it expires
+            self._redis_reads_after = max(
+                self._redis_reads_after, time.monotonic() + self.ttl
+            )
+
+    async def listen(self):
+        """Subscribe to invalidations sent with pg_notify by the admin panel."""
+        if self._listener is not None or self._reconnect is not None:
+            return
+
+        if not await self._connect():
+            self._reconnect_later()
+
+    async def close(self):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await listener.close()
+
+    async def _connect(self) -> bool:
+        listener = None
+        try:
+            listener = await asyncpg.connect(get_database_url())
+            await listener.add_listener(self.channel, self._on_notify)
+        except Exception as e:
+            LOGGER.error(f"Unable to listen for notification changes. {e}")
+            if listener is not None:
+                listener.terminate()
+            return False
+
+        listener.add_termination_listener(self._on_terminated)
+        self._listener = listener
+        return True
+
+    def _on_terminated(self, connection: asyncpg.Connection):
+        # Also called for the connection that close() let go of
+        if connection is not self._listener:
+            return
+
+        LOGGER.error("Lost the notification changes listener, reconnecting.")
+        self._listener = None
+        self._reconnect_later()
+
+    def _reconnect_later(self):
+        self._redis_reads_after = math.inf
+        self._reconnect = asyncio.create_task(self._reconnect_forever())
+
+    async def _reconnect_forever(self):
+        while True:
+            await asyncio.sleep(self.retry_delay)
+            if await self._connect():
+                break
+
+        # Changes sent while nobody listened were missed
+        self.local.clear()
+        self._redis_reads_after = time.monotonic() + self.ttl
+        self._reconnect = None
+        LOGGER.info("Listening for notification changes again")
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        try:
+            notification_id = UUID(payload)
+        except ValueError:
+            # Unknown payload: drop everything rather than serve stale data
+            self.local.clear()
+            return
+
+        task = asyncio.create_task(self.invalidate(notification_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self.local),
+            hits=self.local.hits,
+            redis_hits=self.redis_hits,
+            misses=self.local.misses - self.redis_hits,
+        )
+
+
+@lru_cache
+def get_notification_cache() -> NotificationCache:
+    redis = get_redis() if settings.notification_cache_redis else None
+    return NotificationCache(redis)
@@ -0,0 +1,279 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterable, Iterable, Iterator
+from contextlib import contextmanager
+from functools import lru_cache
+
+from core.config import OutboxProperties, outbox_properties, settings
+from core.logger import logger
+from models.metrics import OutboxStats
+from services.publisher import (
+    EncodedMessage,
+    Publishable,
+    RabbitMQPublisher,
+    get_publisher,
+)
+
+LOGGER = logger()
+
+
+class Outbox:
+    """
+    Write-ahead spool in front of the publisher.
+
+    Messages are acknowledged to the caller as soon as they are committed
+    to a local SQLite file. A background flusher drains the spool into
+    RabbitMQ in batches and deletes a message only once the broker has
+    confirmed it, so whatever was not confirmed is replayed after a restart.
+
+    Every message keeps the content type and encoding it was spooled with,
+    so a codec change does not mislabel the backlog. A message still not
+    confirmed after outbox_max_attempts is moved aside to outbox_dead.
+    """
+
+    def __init__(
+        self,
+        publisher: RabbitMQPublisher,
+        properties: OutboxProperties = outbox_properties,
+    ):
+        self.publisher = publisher
+        self.path = os.path.join(settings.base_dir, properties.outbox_file)
+        self.batch_size = properties.outbox_flush_batch_size
+        self.flush_interval = properties.outbox_flush_interval
+        self.lease = properties.outbox_lease
+        self.retry_delay = properties.outbox_retry_delay
+        self.max_attempts = properties.outbox_max_attempts
+
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+        self._spooled = 0
+        self._flushed = 0
+        self._failed = 0
+        self._dead = 0
+
+    async def start(self):
+        if self._db is None:
+            await asyncio.to_thread(self._open)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+        if self._db is not None:
+            # A cancelled flush may still be running in its worker thread
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def _open(self):
+        LOGGER.info("Opening outbox at %s", self.path)
+        db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=FULL")
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                body BLOB NOT NULL,
+                available_at REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                content_type TEXT,
+                content_encoding TEXT
+            )
+            """
+        )
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox_dead (
+                id INTEGER PRIMARY KEY,
+                body BLOB NOT NULL,
+                attempts INTEGER NOT NULL,
+                content_type TEXT,
+                content_encoding TEXT,
+                dead_at REAL NOT NULL
+            )
+            """
+        )
+        # Spools created before the codec labels were stored
+        columns = {row[1] for row in db.execute("PRAGMA table_info(outbox)")}
+        for column in ("content_type", "content_encoding"):
+            if column not in columns:
+                db.execute(f"ALTER TABLE outbox ADD COLUMN {column} TEXT")
+        self._db = db
+
+    async def publish_message(self, message: Publishable) -> bool:
+        """Durably append a message to the spool."""
+        await self.publish_many((message,))
+        return True
+
+    async def publish_many(
+        self, messages: Iterable[Publishable] | AsyncIterable[Publishable]
+    ) -> list[bool]:
+        """
+        Durably append a batch of messages to the spool in one transaction.
+
+        Returns:
+            list (bool): True for every spooled message, in the order given.
+        """
+        if self._db is None:
+            await self.start()
+
+        if isinstance(messages, AsyncIterable):
+            encoded = [self.publisher.encode(message) async for message in messages]
+        else:
+            encoded = [self.publisher.encode(message) for message in messages]
+
+        await asyncio.to_thread(self._append, encoded)
+        self._spooled += len(encoded)
+        self._wakeup.set()
+
+        return [True] * len(encoded)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._db_lock:
+            db: sqlite3.Connection = self._db  # type: ignore
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def _append(self, messages: list[EncodedMessage]):
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT INTO outbox (body, content_type, content_encoding) "
+                "VALUES (?, ?, ?)",
+                messages,
+            )
+
+    def _claim(self) -> list[tuple[int, bytes, str | None, str | None]]:
+        """Lease a batch of due messages so no other flusher picks them up."""
+        now = time.time()
+        with self._transaction() as db:
+            rows = db.execute(
+                "SELECT id, body, content_type, content_encoding FROM outbox "
+                "WHERE available_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            db.executemany(
+                "UPDATE outbox SET available_at = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                ((now + self.lease, row[0]) for row in rows),
+            )
+        return rows
+
+    def _settle(self, acked: list[int], nacked: list[int]) -> int:
+        """
+        Returns:
+            int: The number of nacked messages moved to outbox_dead.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            db.executemany("DELETE FROM outbox WHERE id = ?", ((i,) for i in acked))
+            db.executemany(
+                "INSERT INTO outbox_dead "
+                "SELECT id, body, attempts, content_type, content_encoding, ? "
+                "FROM outbox WHERE id = ? AND attempts >= ?",
+                ((now, i, self.max_attempts) for i in nacked),
+            )
+            dead = db.executemany(
+                "DELETE FROM outbox WHERE id = ? AND attempts >= ?",
+                ((i, self.max_attempts) for i in nacked),
+            ).rowcount
+            db.executemany(
+                "UPDATE outbox SET available_at = ? WHERE id = ?",
+                ((now + self.retry_delay, i) for i in nacked),
+            )
+        return dead
+
+    def _count(self) -> int:
+        with self._db_lock:
+            db: sqlite3.Connection = self._db  # type: ignore
+            return db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    async def flush(self) -> int:
+        """Publish one batch from the spool.
+
+        Returns:
+            int: The number of messages taken from the spool.
+        """
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+
+        try:
+            outcomes = await self.publisher.publish_many(
+                self._message(*row[1:]) for row in rows
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to flush the outbox. {e}")
+            outcomes = [False] * len(rows)
+
+        acked = [row[0] for row, ok in zip(rows, outcomes) if ok]
+        nacked = [row[0] for row, ok in zip(rows, outcomes) if not ok]
+        dead = await asyncio.to_thread(self._settle, acked, nacked)
+        if dead:
+            LOGGER.error(
+                f"Moved {dead} messages to outbox_dead after "
+                f"{self.max_attempts} publish attempts."
+            )
+
+        self._flushed += len(acked)
+        self._failed += len(nacked)
+        self._dead += dead
+        return len(rows)
+
+    def _message(
+        self, body: bytes, content_type: str | None, content_encoding: str | None
+    ) -> Publishable:
+        # Rows spooled before the labels were stored take the current codec
+        if content_type is None:
+            return body
+        return EncodedMessage(body, content_type, content_encoding)
+
+    async def _flush_forever(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                flushed = await self.flush()
+            except Exception as e:
+                LOGGER.error(f"Outbox flusher error. {e}")
+                flushed = 0
+
+            if flushed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def stats(self) -> OutboxStats:
+        pending = await asyncio.to_thread(self._count) if self._db else 0
+        return OutboxStats(
+            pending=pending,
+            spooled=self._spooled,
+            flushed=self._flushed,
+            failed=self._failed,
+            dead=self._dead,
+        )
+
+
+@lru_cache
+def get_outbox() -> Outbox:
+    return Outbox(get_publisher())
@@ -1,23 +1,51 @@
+import asyncio
+from collections.abc import AsyncIterable, Iterable
+from functools import lru_cache
+from typing import NamedTuple
+
 import aio_pika
+import orjson
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractRobustConnection
+from aio_pika.pool import Pool
+from pamqp.commands import Basic
+from pydantic import BaseModel
 
+from core.codec import MessageCodec
 from core.config import PublisherProperties, publisher_properties
 from core.logger import logger
+from models.metrics import PublisherStats
 
 LOGGER = logger()
 
 
+class EncodedMessage(NamedTuple):
+    """A body encoded earlier, with the codec labels it was encoded with."""
+
+    body: bytes
+    content_type: str
+    content_encoding: str | None
+
+
+Publishable = str | bytes | BaseModel | EncodedMessage
+
+
 class RabbitMQPublisher:
     def __init__(self, properties: PublisherProperties = publisher_properties):
         """Setup the publisher object, passing in the URL we will use
         to connect to RabbitMQ.
         """
-        self._connection = None
-        self._channel = None
+        self._connection: AbstractRobustConnection | None = None
+        self._channel_pool: Pool[AbstractChannel] | None = None
+        self._exchanges: dict[AbstractChannel, AbstractExchange] = {}
 
-        self._deliveries = None
-        self._acked = None
-        self._nacked = None
-        self._message_number = None
+        # Unconfirmed messages by delivery number, bounded by the confirm window
+        self._deliveries: dict[int, asyncio.Future[bool]] = {}
+        self._acked = 0
+        self._nacked = 0
+        self._message_number = 0
+        self._window = asyncio.Semaphore(properties.confirm_window)
+        self._tasks: set[asyncio.Task] = set()
+        self._connect_lock = asyncio.Lock()
 
         self._stopping = False
         self._url = properties.amqp_url
@@ -25,36 +53,269 @@ class RabbitMQPublisher:
         self.EXCHANGE = properties.exchange
         self.EXCHANGE_TYPE = properties.exchange_type
         self.PUBLISH_INTERVAL = properties.publish_interval
+        self.PUBLISH_TIMEOUT = properties.publish_timeout
         self.QUEUE = properties.queue
         self.ROUTING_KEY = properties.routing_key
+        self.CHANNEL_POOL_SIZE = properties.channel_pool_size
+        self.CONFIRM_WINDOW = properties.confirm_window
+
+        self.codec = MessageCodec(
+            properties.message_encoding,
+            properties.message_compression,
+            properties.message_compression_level,
+        )
+
+    @property
+    def acked(self) -> int:
+        return self._acked
+
+    @property
+    def nacked(self) -> int:
+        return self._nacked
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._deliveries)
+
+    def stats(self) -> PublisherStats:
+        return PublisherStats(
+            published=self._message_number,
+            acked=self._acked,
+            nacked=self._nacked,
+            in_flight=self.in_flight,
+            confirm_window=self.CONFIRM_WINDOW,
+        )
 
     async def connect(self):
         """
-        This method connects to RabbitMQ, returning the connection handle.
+        This method connects to RabbitMQ and prepares the channel pool.
+        The connection is robust, so it lives as long as the publisher does.
         """
-        LOGGER.info("Connecting to %s", self._url)
-        self._connection = await aio_pika.connect_robust(self._url)
+        if self._connection is not None:
+            return
 
-    async def open_channel(self):
+        # Concurrent first publishes share a single connection
+        async with self._connect_lock:
+            if self._connection is not None:
+                return
+
+            LOGGER.info("Connecting to %s", self._url)
+            self._stopping = False
+            self._connection = await aio_pika.connect_robust(self._url)
+            self._channel_pool = Pool(
+                self.open_channel, max_size=self.CHANNEL_POOL_SIZE
+            )
+
+    async def close(self):
+        """Wait for outstanding confirms, then close the channel pool
+        and the connection."""
+        self._stopping = True
+        await self.wait_for_confirms()
+
+        if self._channel_pool is not None:
+            await self._channel_pool.close()
+            self._channel_pool = None
+        self._exchanges.clear()
+
+        if self._connection is not None:
+            LOGGER.info("Closing connection to %s", self._url)
+            await self._connection.close()
+            self._connection = None
+
+    async def open_channel(self) -> AbstractChannel:
         """This method will open a new channel with RabbitMQ by issuing the
-        Channel.Open RPC command.
+        Channel.Open RPC command. It is used by the pool to fill itself up.
+        Channels are opened in publisher confirms mode.
         """
         LOGGER.info("Creating a new channel")
-        self._channel = await self._connection.channel()
+        return await self._connection.channel(publisher_confirms=True)  # type: ignore
+
+    async def get_exchange(self, channel: AbstractChannel) -> AbstractExchange:
+        """Return the exchange bound to the channel, declaring it only once."""
+        exchange = self._exchanges.get(channel)
+        if exchange is None:
+            exchange = await channel.get_exchange(self.EXCHANGE)
+            self._exchanges[channel] = exchange
+        return exchange
 
-    async def publish_message(self, message: str, hdrs: dict | None = None):
-        if self._connection is None:
+    async def send(
+        self, message: Publishable, hdrs: dict | None = None
+    ) -> asyncio.Future[bool]:
+        """
+        Publish a message without waiting for the broker confirmation.
+
+        Waits only while the confirm window is full.
+
+        Returns:
+            Future: resolves to True once the broker acks the message and to
+            False if it is nacked or the publish fails.
+        """
+        if self._channel_pool is None:
             await self.connect()
 
-        await self.open_channel()
+        sent: asyncio.Future[
+            asyncio.Future[bool]
+        ] = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._send_on_channel(message, hdrs, sent))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return await sent
+
+    async def _send_on_channel(
+        self,
+        message: Publishable,
+        hdrs: dict | None,
+        sent: asyncio.Future[asyncio.Future[bool]],
+    ):
+        # The channel stays taken until the broker settles the message, so
+        # that concurrent sends spread over the pool instead of all reusing
+        # the channel released first.
+        try:
+            async with self._channel_pool.acquire() as channel:  # type: ignore
+                exchange = await self.get_exchange(channel)
+                delivery = await self._send(exchange, self.encode(message), hdrs)
+                sent.set_result(delivery)
+                await asyncio.wait([delivery])
+        except Exception as e:
+            if not sent.done():
+                sent.set_exception(e)
+
+    async def _send(
+        self, exchange: AbstractExchange, message: EncodedMessage, hdrs: dict | None
+    ) -> asyncio.Future[bool]:
+        await self._window.acquire()
 
-        exchange = await self._channel.get_exchange(self.EXCHANGE)
-        await exchange.publish(
-            aio_pika.Message(bytes(message, encoding="utf8")),
-            routing_key=self.ROUTING_KEY,
-            timeout=5.0,
+        self._message_number += 1
+        delivery_tag = self._message_number
+        delivery = asyncio.get_running_loop().create_future()
+        self._deliveries[delivery_tag] = delivery
+
+        task = asyncio.create_task(self._deliver(exchange, delivery_tag, message, hdrs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return delivery
+
+    async def _deliver(
+        self,
+        exchange: AbstractExchange,
+        delivery_tag: int,
+        message: EncodedMessage,
+        hdrs: dict | None,
+    ):
+        acked = False
+        try:
+            confirmation = await exchange.publish(
+                aio_pika.Message(
+                    message.body,
+                    headers=hdrs,
+                    content_type=message.content_type,
+                    content_encoding=message.content_encoding,
+                ),
+                routing_key=self.ROUTING_KEY,
+                timeout=self.PUBLISH_TIMEOUT,
+            )
+            acked = isinstance(confirmation, Basic.Ack)
+            if not acked:
+                LOGGER.warning(
+                    "Message %s was not acked: %s", delivery_tag, confirmation
+                )
+        except Exception as e:
+            LOGGER.error(f"Failed to publish message {delivery_tag}. {e}")
+        finally:
+            self._confirm(delivery_tag, acked)
+
+    def _confirm(self, delivery_tag: int, acked: bool):
+        if acked:
+            self._acked += 1
+        else:
+            self._nacked += 1
+
+        delivery = self._deliveries.pop(delivery_tag)
+        if not delivery.done():
+            delivery.set_result(acked)
+        self._window.release()
+
+    async def wait_for_confirms(self) -> bool:
+        """Wait until every message sent so far is confirmed.
+
+        Returns:
+            bool: True if all of them were acked.
+        """
+        if not self._deliveries:
+            return True
+        outcomes = await asyncio.gather(*self._deliveries.values())
+        return all(outcomes)
+
+    async def publish_message(
+        self, message: Publishable, hdrs: dict | None = None
+    ) -> bool:
+        """Publish a message and wait for the broker confirmation."""
+        delivery = await self.send(message, hdrs)
+        return await delivery
+
+    async def publish_many(
+        self,
+        messages: Iterable[Publishable] | AsyncIterable[Publishable],
+        hdrs: dict | None = None,
+    ) -> list[bool]:
+        """
+        Publish a batch of messages over a single channel.
+
+        Messages are serialized and sent one after another without waiting
+        for confirms in between, so the whole batch is pipelined through
+        the confirm window.
+
+        Returns:
+            list (bool): The outcome of every message, in the order given.
+        """
+        if self._channel_pool is None:
+            await self.connect()
+
+        deliveries = []
+        async with self._channel_pool.acquire() as channel:  # type: ignore
+            exchange = await self.get_exchange(channel)
+
+            if isinstance(messages, AsyncIterable):
+                async for message in messages:
+                    encoded = self.encode(message)
+                    deliveries.append(await self._send(exchange, encoded, hdrs))
+            else:
+                for message in messages:
+                    encoded = self.encode(message)
+                    deliveries.append(await self._send(exchange, encoded, hdrs))
+
+        return list(await asyncio.gather(*deliveries))
+
+    def encode(self, message: Publishable) -> EncodedMessage:
+        """Serialize a message and label it with the configured codec.
+
+        Messages encoded earlier keep the labels they were encoded with.
+        """
+        if isinstance(message, EncodedMessage):
+            return message
+        return EncodedMessage(
+            self.serialize(message),
+            self.codec.content_type,
+            self.codec.content_encoding,
         )
 
+    def serialize(self, message: Publishable) -> bytes:
+        """Encode a message with the configured codec.
+
+        Bytes are taken as already encoded; strings are taken as JSON.
+        """
+        if isinstance(message, EncodedMessage):
+            return message.body
+        if isinstance(message, bytes):
+            return message
+        if isinstance(message, BaseModel):
+            return self.codec.encode(message)
+        if self.codec.is_plain_json:
+            return bytes(message, encoding="utf8")
+        return self.codec.encode(orjson.loads(message))
+
 
+@lru_cache
 def get_publisher() -> RabbitMQPublisher:
     return RabbitMQPublisher()
@@ -1,32 +1,123 @@
+import asyncio
 import typing
 import uuid
+from itertools import islice
 from uuid import UUID
 
 import backoff
 import httpx
 import orjson
 
-from core.config import authorization_data, user_properties
+from core.config import user_properties
 from core.logger import logger
 from models.users import NotificationChannel, User, UserChannels
 from services.abc import UserServiceABC
+from services.auth import TokenManager, get_token_manager
+from services.http import get_http_client
+from services.user_cache import UserCache, get_channels_cache, get_users_cache
 
 LOGGER = logger()
 
+T = typing.TypeVar("T")
+M = typing.TypeVar("M", User, UserChannels)
+Serializer = typing.Callable[
+    [typing.Iterable[typing.Mapping[str, typing.Any]]],
+    typing.Awaitable[typing.Iterable[M]],
+]
+
+
+def chunked(items: typing.Iterable[T], size: int) -> typing.Iterator[list[T]]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _is_client_error(e: Exception) -> bool:
+    """Only network errors and 5xx responses are worth retrying."""
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+
 
 class UserService(UserServiceABC):
-    def __init__(self, client: httpx.AsyncClient):
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        token_manager: TokenManager,
+        users_cache: UserCache[User],
+        channels_cache: UserCache[UserChannels],
+    ):
         self.client = client
+        self.token_manager = token_manager
+        self.users_cache = users_cache
+        self.channels_cache = channels_cache
 
     async def get_users(self, user_ids: typing.Iterable[UUID]) -> typing.Iterable[User]:
-        body = orjson.dumps({"ids": [str(uid) for uid in user_ids]})
-        users = await self._get_request_with_body(user_properties.url_get_users, body)
+        users: list[User] = []
+        async for chunk in self.iter_users(user_ids):
+            users.extend(chunk)
 
-        serialized_users = await self._serialize_users(users)
+        return users
 
-        return serialized_users
+    def iter_users(
+        self, user_ids: typing.Iterable[UUID]
+    ) -> typing.AsyncIterator[typing.Iterable[User]]:
+        return self._iter_cached(
+            user_properties.url_get_users,
+            user_ids,
+            self._serialize_users,
+            self.users_cache,
+        )
 
-    @backoff.on_exception(backoff.expo, httpx.RequestError, max_tries=5)
+    async def _iter_cached(
+        self,
+        url: str,
+        user_ids: typing.Iterable[UUID],
+        serialize: Serializer[M],
+        cache: UserCache[M],
+    ) -> typing.AsyncIterator[typing.Iterable[M]]:
+        """Yields the cached entries first, then whatever the auth service
+        returns for the remaining ids, caching it on the way."""
+        cached, missing = await cache.get_many(str(uid) for uid in user_ids)
+        if cached:
+            yield cached
+
+        async for chunk in self._iter_chunks(url, missing, serialize):
+            await cache.set_many({item.id: item for item in chunk})  # type: ignore
+            yield chunk
+
+    async def _iter_chunks(
+        self, url: str, user_ids: typing.Iterable[UUID | str], serialize: Serializer[M]
+    ) -> typing.AsyncIterator[typing.Iterable[M]]:
+        """
+        Requests the ids in chunks of users_chunk_size, at most
+        users_concurrency at a time, and yields every chunk as soon as it is
+        serialized, in completion order.
+        """
+        ids = (str(uid) for uid in user_ids)
+        semaphore = asyncio.Semaphore(user_properties.users_concurrency)
+
+        async def fetch(chunk: list[str]) -> typing.Iterable[M]:
+            async with semaphore:
+                body = orjson.dumps({"ids": chunk})
+                data = await self._get_request_with_body(url, body)
+            return await serialize(data)
+
+        tasks = [
+            asyncio.create_task(fetch(chunk))
+            for chunk in chunked(ids, user_properties.users_chunk_size)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @backoff.on_exception(
+        backoff.expo,
+        (httpx.RequestError, httpx.HTTPStatusError),
+        max_tries=5,
+        giveup=_is_client_error,
+    )
     async def _get_request_with_body(
         self, url: str, body: typing.Mapping[str, typing.Any]
     ) -> typing.Iterable[typing.Mapping[str, typing.Any]]:
@@ -43,8 +134,23 @@ class UserService(UserServiceABC):
         Raises:
             HTTPError: If the request fails with a non-200 status code.
         """
-        # url = user_properties.url_get_users_channels
-        access_token = await self._get_access_token()
+        access_token = await self.token_manager.get_access_token(self.client)
+        response = await self._send_with_body(url, body, access_token)
+
+        if response.status_code == httpx.codes.UNAUTHORIZED:
+            # The token was revoked or expired early: refresh it and retry once
+            self.token_manager.invalidate(access_token)
+            access_token = await self.token_manager.get_access_token(self.client)
+            response = await self._send_with_body(url, body, access_token)
+
+        if response.status_code != 200:
+            response.raise_for_status()
+
+        return response.json()
+
+    async def _send_with_body(
+        self, url: str, body: typing.Mapping[str, typing.Any], access_token: str
+    ) -> httpx.Response:
         headers = {
             'Content-Type': "application/json",
             'X-Request-Id': str(uuid.uuid4()),
@@ -52,23 +158,27 @@ class UserService(UserServiceABC):
         }
 
         request = httpx.Request('GET', url, data=body, headers=headers)
-        response = await self.client.send(request=request)
-        if response.status_code != 200:
-            response.raise_for_status()
-
-        return response.json()
+        return await self.client.send(request=request)
 
     async def get_users_channels(
         self, user_ids: typing.Iterable[UUID]
     ) -> typing.Iterable[UserChannels]:
-        body = orjson.dumps({"ids": [str(uid) for uid in user_ids]})
-        users_channels = await self._get_request_with_body(
-            user_properties.url_get_users_channels, body
-        )
+        users_channels: list[UserChannels] = []
+        async for chunk in self.iter_users_channels(user_ids):
+            users_channels.extend(chunk)
 
-        serialized_channels = await self._serialize_users_channels(users_channels)
+        return users_channels
 
-        return serialized_channels
+    def iter_users_channels(
+        self, user_ids: typing.Iterable[UUID]
+    ) -> typing.AsyncIterator[typing.Iterable[UserChannels]]:
+        """Yields users channels chunk by chunk as the auth service answers."""
+        return self._iter_cached(
+            user_properties.url_get_users_channels,
+            user_ids,
+            self._serialize_users_channels,
+            self.channels_cache,
+        )
 
     async def _serialize_users_channels(
         self, _users_channels: typing.Iterable[typing.Mapping[str, typing.Any]]
@@ -129,48 +239,12 @@ class UserService(UserServiceABC):
 
         return users
 
-    async def _get_access_token(self) -> str | None:
-        refresh_token = await self._get_refresh_token()
-
-        url = user_properties.url_refresh_token
-        headers = {
-            'X-Request-Id': str(uuid.uuid4()),
-            'Authorization': f'Bearer {refresh_token}',
-        }
-        request = httpx.Request('POST', url, headers=headers)
-        response = await self.client.send(request=request)
-        LOGGER.info(response.status_code)
-        if response.status_code == 200:
-            access_token = response.json()['access_token']
-            await self._set_access_token(access_token)
-            return access_token
-        response.raise_for_status()
-
-    async def _get_refresh_token(self) -> str | None:
-
-        url = user_properties.url_login
-        headers = {'X-Request-Id': str(uuid.uuid4())}
-        data = {
-            "username": user_properties.username,
-            "password": user_properties.password,
-        }
-        response = await self.client.post(url=url, headers=headers, data=data)
-        if response.status_code == 200:
-            refresh_token = response.json()['refresh_token']
-            await self._set_refresh_token(refresh_token)
-            return refresh_token
-        response.raise_for_status()
-
-    async def _set_access_token(self, access_token):
-        authorization_data['access_token'] = access_token
-
-    async def _set_refresh_token(self, refresh_token):
-        authorization_data['refresh_token'] = refresh_token
-
 
 def get_service() -> UserService:
-    return UserService(httpx.AsyncClient())
+    return UserService(
+        get_http_client(), get_token_manager(), get_users_cache(), get_channels_cache()
+    )
 
 
 async def get_user_service() -> typing.AsyncGenerator[UserService, None]:
-    yield UserService(httpx.AsyncClient())
+    yield get_service()
@@ -0,0 +1,120 @@
+import typing
+from functools import lru_cache
+
+from pydantic import BaseModel
+from redis.asyncio import Redis
+
+from core.cache import TTLCache
+from core.config import UsersProperties, user_properties
+from core.logger import logger
+from db.redis import get_redis
+from models.metrics import CacheStats
+from models.users import User, UserChannels
+
+LOGGER = logger()
+
+M = typing.TypeVar("M", bound=BaseModel)
+
+
+class UserCache(typing.Generic[M]):
+    """
+    Read-through cache of auth service data keyed by user id.
+
+    A bounded in-process LRU sits in front of Redis; Redis is read with one
+    MGET and written with one pipelined batch of SET EX per lookup, so only
+    the ids missing from both tiers need to go to the auth service.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        model: type[M],
+        redis: Redis | None = None,
+        properties: UsersProperties = user_properties,
+    ):
+        self.namespace = namespace
+        self.model = model
+        self.redis = redis
+        self.ttl = int(properties.users_cache_ttl)
+        self.local: TTLCache[str, M] = TTLCache(
+            properties.users_cache_size, properties.users_cache_ttl
+        )
+        self.redis_hits = 0
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.namespace}:{user_id}"
+
+    async def get_many(
+        self, user_ids: typing.Iterable[str]
+    ) -> tuple[list[M], list[str]]:
+        """
+        Returns:
+            tuple: The cached values and the ids that were not found.
+        """
+        found: list[M] = []
+        missing: list[str] = []
+
+        for user_id in user_ids:
+            value = self.local.get(user_id)
+            if value is None:
+                missing.append(user_id)
+            else:
+                found.append(value)
+
+        if not missing or self.redis is None:
+            return found, missing
+
+        try:
+            raw_values = await self.redis.mget([self._key(i) for i in missing])
+        except Exception as e:
+            LOGGER.error(f"Unable to read {self.namespace} from Redis. {e}")
+            return found, missing
+
+        still_missing = []
+        for user_id, raw in zip(missing, raw_values):
+            if raw is None:
+                still_missing.append(user_id)
+                continue
+            value = self.model.parse_raw(raw)
+            self.local.set(user_id, value)
+            found.append(value)
+
+        self.redis_hits += len(missing) - len(still_missing)
+        return found, still_missing
+
+    async def set_many(self, values: typing.Mapping[str, M]):
+        for user_id, value in values.items():
+            self.local.set(user_id, value)
+
+        if not values or self.redis is None:
+            return
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id, value in values.items():
+                    pipe.set(self._key(user_id), value.json(), ex=self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            LOGGER.error(f"Unable to write {self.namespace} to Redis. {e}")
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self.local),
+            hits=self.local.hits,
+            redis_hits=self.redis_hits,
+            misses=self.local.misses - self.redis_hits,
+        )
+
+
+def _get_redis() -> Redis | None:
+    return get_redis() if user_properties.users_cache_redis else None
+
+
+@lru_cache
+def get_users_cache() -> UserCache[User]:
+    return UserCache("user", User, _get_redis())
+
+
+@lru_cache
+def get_channels_cache() -> UserCache[UserChannels]:
+    return UserCache("user_channels", UserChannels, _get_redis())
@@ -0,0 +1,41 @@
+import asyncio
+
+from core.logger import logger
+from db.redis import get_redis
+from services.http import get_http_client
+from services.jobs import get_shard_queue, get_shard_worker
+from services.notification_cache import get_notification_cache
+from services.outbox import get_outbox
+from services.publisher import get_publisher
+
+LOGGER = logger()
+
+
+async def main():
+    """Run fan-out shards taken from the shard queue until stopped."""
+    publisher = get_publisher()
+    outbox = get_outbox()
+    notification_cache = get_notification_cache()
+    shard_queue = get_shard_queue()
+    shard_worker = get_shard_worker()
+    await publisher.connect()
+    await outbox.start()
+    await notification_cache.listen()
+    await shard_queue.connect()
+    await shard_worker.start()
+    LOGGER.info("Waiting for fan-out shards on %s", shard_queue.name)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await shard_worker.stop()
+        await shard_queue.close()
+        await notification_cache.close()
+        await outbox.stop()
+        await publisher.close()
+        await get_redis().close()
+        await get_http_client().aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,196 @@
+from collections import OrderedDict
+from uuid import UUID, uuid4
+
+from core.config import PublisherProperties
+from models.notifications import GroupedContext, Notification
+from models.queue import MessageType
+from models.users import NotificationChannel, UserChannels
+from services.fanout import build_channel_index, build_messages, split_recipients
+
+
+def user(user_id: UUID, *channels: tuple[str, str]) -> UserChannels:
+    return UserChannels(
+        id=str(user_id),
+        channels=[
+            NotificationChannel(type=type_, value=value) for type_, value in channels
+        ],
+    )
+
+
+def notification() -> Notification:
+    return Notification(
+        id=uuid4(),
+        template_id=uuid4(),
+        channels=["email"],
+        context_vars={},
+        title="Hello",
+    )
+
+
+def group(user_ids: list[UUID], **context) -> GroupedContext:
+    return GroupedContext(user_ids=user_ids, context=OrderedDict(context))
+
+
+def test_channel_index_keeps_the_first_user_of_an_address():
+    first, second = uuid4(), uuid4()
+    index = build_channel_index(
+        [
+            user(first, ("email", "shared@example.com")),
+            user(second, ("email", "shared@example.com"), ("email", "own@example.com")),
+        ]
+    )
+
+    assert index["email"] == [
+        (str(first), "shared@example.com"),
+        (str(second), "own@example.com"),
+    ]
+
+
+def test_channel_index_dedups_normalized_emails():
+    first, second = uuid4(), uuid4()
+    index = build_channel_index(
+        [
+            user(first, ("email", "Someone@Example.COM")),
+            user(second, ("email", "Someone@example.com")),
+        ]
+    )
+
+    assert index["email"] == [(str(first), "Someone@example.com")]
+
+
+def test_channel_index_partitions_users_with_several_channel_types():
+    user_id = uuid4()
+    index = build_channel_index(
+        [user(user_id, ("email", "a@example.com"), ("sms", "+100"), ("sms", "+200"))]
+    )
+
+    assert index == {
+        "email": [(str(user_id), "a@example.com")],
+        "sms": [(str(user_id), "+100"), (str(user_id), "+200")],
+    }
+
+
+def test_channel_index_addresses_are_deduplicated_per_channel_type():
+    first, second = uuid4(), uuid4()
+    index = build_channel_index(
+        [user(first, ("sms", "same")), user(second, ("telegram", "same"))]
+    )
+
+    assert index == {"sms": [(str(first), "same")], "telegram": [(str(second), "same")]}
+
+
+def test_channel_index_drops_invalid_emails():
+    user_id = uuid4()
+    index = build_channel_index(
+        [user(user_id, ("email", "not an email"), ("email", "ok@example.com"))]
+    )
+
+    assert index["email"] == [(str(user_id), "ok@example.com")]
+
+
+def test_split_recipients_by_count():
+    chunks = list(split_recipients([f"{i}@x.io" for i in range(5)], 2, 1024))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_split_recipients_by_bytes():
+    # Every address costs its 7 bytes and 3 bytes of quotes and separator
+    chunks = list(split_recipients([f"{i}@x.io" for i in range(5)], 100, 25))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+
+def test_split_recipients_gives_an_oversized_address_its_own_chunk():
+    big = "a" * 50 + "@x.io"
+    chunks = list(split_recipients(["1@x.io", big, "2@x.io"], 100, 20))
+
+    assert chunks == [["1@x.io"], [big], ["2@x.io"]]
+
+
+def test_messages_follow_the_context_groups():
+    alice, bob, carol, stranger = uuid4(), uuid4(), uuid4(), uuid4()
+    index = build_channel_index(
+        [
+            user(alice, ("email", "alice@example.com"), ("sms", "+1")),
+            user(bob, ("email", "bob@example.com")),
+            user(carol, ("email", "carol@example.com")),
+            user(stranger, ("email", "stranger@example.com")),
+        ]
+    )
+    groups = [group([alice, carol], name="A"), group([bob], name="B")]
+
+    messages = build_messages(notification(), groups, index)
+
+    # The sms channel is not one of the notification channels, and users out
+    # of every group get nothing
+    assert [(m.context, m.recipients.to_) for m in messages] == [
+        ({"name": "A"}, ["alice@example.com", "carol@example.com"]),
+        ({"name": "B"}, ["bob@example.com"]),
+    ]
+    assert {m.type for m in messages} == {MessageType.email}
+    assert {m.recipients.from_ for m in messages} == {"notifications@movix.ru"}
+
+
+def test_messages_are_chunked_within_a_group():
+    users = [uuid4() for _ in range(5)]
+    index = build_channel_index(
+        [
+            user(user_id, ("email", f"{n}@example.com"))
+            for n, user_id in enumerate(users)
+        ]
+    )
+    properties = PublisherProperties(message_max_recipients=2)
+
+    messages = build_messages(
+        notification(), [group(users, name="A")], index, properties
+    )
+
+    assert [m.recipients.to_ for m in messages] == [
+        ["0@example.com", "1@example.com"],
+        ["2@example.com", "3@example.com"],
+        ["4@example.com"],
+    ]
+
+
+def test_every_multi_channel_user_is_addressed_once_per_group():
+    users = [uuid4() for _ in range(2_000)]
+    users_channels = [
+        user(user_id, ("email", f"user{n}@example.com"), ("sms", f"+{n}"))
+        for n, user_id in enumerate(users)
+    ]
+    groups = [group(users[n::4], bucket=n) for n in range(4)]
+    properties = PublisherProperties(message_max_recipients=100)
+
+    messages = build_messages(
+        notification(), groups, build_channel_index(users_channels), properties
+    )
+
+    addressed = [address for m in messages for address in m.recipients.to_]
+    assert sorted(addressed) == sorted(f"user{n}@example.com" for n in range(2_000))
+    for bucket in range(4):
+        expected = {f"user{n}@example.com" for n in range(bucket, 2_000, 4)}
+        assert {
+            address
+            for m in messages
+            if m.context == {"bucket": bucket}
+            for address in m.recipients.to_
+        } == expected
+    # 500 recipients a group, 100 a message
+    assert len(messages) == 20
+
+
+def test_user_ids_of_the_auth_service_are_matched_in_any_form():
+    user_id = uuid4()
+    index = build_channel_index(
+        [
+            UserChannels(
+                id=user_id.hex.upper(),
+                channels=[NotificationChannel(type="email", value="a@example.com")],
+            )
+        ]
+    )
+
+    messages = build_messages(notification(), [group([user_id], name="A")], index)
+
+    assert [m.recipients.to_ for m in messages] == [["a@example.com"]]